@@ -3,34 +3,298 @@ Stage 4: Query and Analysis Functions
 Provides functions to query and analyze invoice data from CSVs
 """
 
+import numpy as np
+import os
 import pandas as pd
+from pandas.api.types import is_datetime64_any_dtype, is_numeric_dtype
+from functools import cached_property
 from pathlib import Path
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Callable
+
+try:
+    from numba import njit  # also enables pandas' numba groupby engine
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+# Date format written by the Stage 2 extraction prompt / Stage 3 export
+DATE_FORMAT = '%Y-%m-%d'
+
+# Numeric columns (coerced on load: the extraction may give a number as text)
+INVOICE_AMOUNT_COLUMNS = ('subtotal', 'tax', 'discount', 'freight', 'total')
+LINE_ITEM_AMOUNT_COLUMNS = ('quantity', 'unit_price', 'total_price')
+
+# Below this many rows the one-off numba JIT compile outweighs the faster kernels
+NUMBA_MIN_ROWS = 100_000
+
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _month_totals_jit(months: np.ndarray, totals: np.ndarray, n_months: int):
+        """Single pass: sum totals and count rows per month offset"""
+        revenue = np.zeros(n_months)
+        counts = np.zeros(n_months, dtype=np.int64)
+        for i in range(months.shape[0]):
+            revenue[months[i]] += totals[i]
+            counts[months[i]] += 1
+        return revenue, counts
+
+
+def _month_totals(months: np.ndarray, totals: np.ndarray, n_months: int):
+    """Revenue and invoice count per month offset, without building a grouper"""
+    if NUMBA_AVAILABLE and len(months) >= NUMBA_MIN_ROWS:
+        return _month_totals_jit(months, totals, n_months)
+    return (np.bincount(months, weights=totals, minlength=n_months),
+            np.bincount(months, minlength=n_months))
 
 
 class InvoiceAnalyzer:
     """Query and analyze invoice data from CSV files"""
     
     def __init__(self, csv_dir: str = "stage3_csv"):
-        """Load all CSV files"""
+        """
+        Point the analyzer at the Stage 3 output
+        
+        Tables and the lookup structures derived from them load lazily on first
+        use, so a query only pays for the data it touches.
+        """
         self.csv_dir = Path(csv_dir)
         
-        print("📊 Loading CSV data...")
-        self.vendors = pd.read_csv(self.csv_dir / "vendors.csv")
-        self.customers = pd.read_csv(self.csv_dir / "customers.csv")
-        self.invoices = pd.read_csv(self.csv_dir / "invoices.csv")
-        self.line_items = pd.read_csv(self.csv_dir / "line_items.csv")
+        # Memoized get_invoice_details results (the data is static once loaded)
+        self._invoice_details_cache: Dict[Any, Dict[str, Any]] = {}
+        
+        print(f"📊 Invoice data: {self.csv_dir}/ (tables load on first use)")
+    
+    # ------------------------------------------------------------------
+    # Tables
+    # ------------------------------------------------------------------
+    
+    @cached_property
+    def vendors(self) -> pd.DataFrame:
+        return self._load_table("vendors")
+    
+    @cached_property
+    def customers(self) -> pd.DataFrame:
+        return self._load_table("customers")
+    
+    @cached_property
+    def invoices(self) -> pd.DataFrame:
+        invoices = self._load_table("invoices", prepare=self._prepare_invoices)
+        
+        # Compact dtypes (runs after every load: Parquet does not round-trip
+        # integer categoricals). Invoice foreign keys share the vendor/customer
+        # id universe, so categorical codes line up with those tables.
+        invoices['vendor_id'] = invoices['vendor_id'].astype(
+            pd.CategoricalDtype(self.vendors['vendor_id'])
+        )
+        invoices['customer_id'] = invoices['customer_id'].astype(
+            pd.CategoricalDtype(self.customers['customer_id'])
+        )
+        # Monetary columns stay float64: float32 cannot represent cents exactly
+        invoices['invoice_id'] = pd.to_numeric(invoices['invoice_id'], downcast='integer')
+        
+        return invoices
+    
+    @cached_property
+    def line_items(self) -> pd.DataFrame:
+        line_items = self._load_table(
+            "line_items", prepare=self._prepare_line_items, label="line items"
+        )
+        
+        for column in ('product_id', 'unit'):
+            line_items[column] = line_items[column].astype('category')
+        for column in ('invoice_id', 'line_item_id'):
+            line_items[column] = pd.to_numeric(line_items[column], downcast='integer')
+        
+        return line_items
+    
+    # ------------------------------------------------------------------
+    # Derived lookup structures
+    # ------------------------------------------------------------------
+    
+    @cached_property
+    def invoices_by_number(self) -> pd.DataFrame:
+        """Invoices indexed by number (first invoice wins for duplicate numbers)"""
+        return self.invoices.drop_duplicates('invoice_number').set_index(
+            'invoice_number', drop=False
+        )
+    
+    @cached_property
+    def vendors_by_id(self) -> pd.DataFrame:
+        return self.vendors.set_index('vendor_id', drop=False)
+    
+    @cached_property
+    def customers_by_id(self) -> pd.DataFrame:
+        return self.customers.set_index('customer_id', drop=False)
+    
+    @cached_property
+    def line_items_by_invoice(self) -> pd.DataFrame:
+        """Line items on a sorted invoice_id index (binary-search slicing)"""
+        return self.line_items.set_index('invoice_id', drop=False).sort_index(kind='stable')
+    
+    @cached_property
+    def _vendor_name(self) -> Dict[Any, str]:
+        """vendor_id -> name, used instead of a merge to attach names"""
+        return dict(zip(self.vendors['vendor_id'], self.vendors['name']))
+    
+    @cached_property
+    def _customer_name(self) -> Dict[Any, str]:
+        """customer_id -> name"""
+        return dict(zip(self.customers['customer_id'], self.customers['name']))
+    
+    @cached_property
+    def _product_desc(self) -> pd.Series:
+        """product_id -> first description seen"""
+        return self.line_items.drop_duplicates('product_id').set_index(
+            'product_id'
+        )['description']
+    
+    @cached_property
+    def _vendor_names_lower(self) -> pd.Series:
+        """Lowercased Arrow strings: case-insensitive search becomes a literal substring scan"""
+        return self.vendors['name'].astype('string[pyarrow]').str.lower()
+    
+    @cached_property
+    def _line_items_desc_lower(self) -> pd.Series:
+        return self.line_items['description'].astype('string[pyarrow]').str.lower()
+    
+    @cached_property
+    def _invoice_dates(self) -> np.ndarray:
+        return self.invoices['invoice_date'].to_numpy(dtype='datetime64[ns]')
+    
+    @cached_property
+    def _invoice_months(self):
+        """
+        (first month, per-invoice month offsets from it)
+        
+        Undated invoices sort last and are left out, like the NaT group in a groupby.
+        """
+        months = self._invoice_dates[~np.isnat(self._invoice_dates)].astype('datetime64[M]')
+        first_month = months[0] if len(months) else np.datetime64('NaT', 'M')
+        return first_month, (months - first_month).astype(np.intp)
+    
+    def _load_table(self, name: str, 
+                    prepare: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+                    label: Optional[str] = None) -> pd.DataFrame:
+        """
+        Load a table from Parquet, rebuilding it from CSV if the CSV is newer
+        
+        Parquet stores already-typed columns, so loading it skips CSV parsing;
+        the file is memory-mapped. Stage 3 writes it with dates as text, so
+        ``prepare`` runs on every load; it skips columns that are already
+        converted, and whenever it changes a dtype the prepared table is
+        written back, so later loads find every column typed.
+        
+        Args:
+            name: Table name (``<name>.csv`` / ``<name>.parquet`` in csv_dir)
+            prepare: Optional dtype conversions (must skip converted columns)
+            label: Name used in the load message (defaults to ``name``)
+        
+        Returns:
+            DataFrame with the table contents
+        """
+        csv_path = self.csv_dir / f"{name}.csv"
+        parquet_path = self.csv_dir / f"{name}.parquet"
+        
+        from_parquet = parquet_path.exists() and (
+            not csv_path.exists() 
+            or parquet_path.stat().st_mtime >= csv_path.stat().st_mtime
+        )
         
-        # Convert dates
-        self.invoices['invoice_date'] = pd.to_datetime(self.invoices['invoice_date'])
-        self.invoices['order_date'] = pd.to_datetime(self.invoices['order_date'], errors='coerce')
-        self.invoices['due_date'] = pd.to_datetime(self.invoices['due_date'], errors='coerce')
+        if from_parquet:
+            df = pd.read_parquet(parquet_path, engine='pyarrow', memory_map=True)
+        else:
+            # Arrow's multithreaded columnar CSV parser
+            df = pd.read_csv(csv_path, engine='pyarrow')
+        
+        dtypes = df.dtypes.copy()
+        if prepare is not None:
+            df = prepare(df)
+        
+        if not from_parquet or not df.dtypes.equals(dtypes):
+            # Written beside the file and swapped in: the old file may still be memory-mapped
+            tmp_path = parquet_path.with_suffix('.parquet.tmp')
+            try:
+                df.to_parquet(tmp_path, engine='pyarrow', compression='zstd', index=False)
+                os.replace(tmp_path, parquet_path)
+            except OSError as e:
+                print(f"   ⚠️  Could not write Parquet cache {parquet_path.name}: {e}")
+        
+        print(f"   ✅ Loaded {len(df)} {label or name}")
+        return df
+    
+    @staticmethod
+    def _group_sum(grouped, columns: List[str], n_rows: int) -> pd.DataFrame:
+        """Sum columns per group, using the parallel numba engine on large tables"""
+        if NUMBA_AVAILABLE and n_rows >= NUMBA_MIN_ROWS:
+            return grouped[columns].sum(
+                engine='numba',
+                engine_kwargs={'parallel': True, 'nopython': True}
+            )
+        return grouped[columns].sum()
+    
+    @staticmethod
+    def _rank(df: pd.DataFrame, column: str, top_n: Optional[int]) -> pd.DataFrame:
+        """Sort descending by column, using a partial selection when only top_n rows are needed"""
+        if top_n is None:
+            return df.sort_values(column, ascending=False)
+        return df.nlargest(top_n, column)
+    
+    def _date_slice(self, start_date: Optional[str] = None, 
+                    end_date: Optional[str] = None) -> slice:
+        """Positional slice of the date-sorted invoices within [start_date, end_date]"""
+        if not start_date and not end_date:
+            return slice(0, len(self._invoice_dates))
+        # Undated invoices sort to the end and never fall inside a range
+        n_dated = int(self.invoices['invoice_date'].notna().sum())
+        lo, hi = 0, n_dated
+        if start_date:
+            lo = np.searchsorted(
+                self._invoice_dates, pd.Timestamp(start_date).to_datetime64(), side='left'
+            )
+        if end_date:
+            hi = min(n_dated, np.searchsorted(
+                self._invoice_dates, pd.Timestamp(end_date).to_datetime64(), side='right'
+            ))
+        return slice(min(lo, n_dated), hi)
+    
+    @staticmethod
+    def _prepare_invoices(invoices: pd.DataFrame) -> pd.DataFrame:
+        """
+        Convert invoice date columns (explicit formats keep parsing on the C path)
         
-        print(f"   ✅ Loaded {len(self.invoices)} invoices")
-        print(f"   ✅ Loaded {len(self.line_items)} line items")
-        print(f"   ✅ Loaded {len(self.vendors)} vendors")
-        print(f"   ✅ Loaded {len(self.customers)} customers")
+        Invoices come back sorted by date, so date ranges become contiguous slices.
+        """
+        if not is_datetime64_any_dtype(invoices['invoice_date']):
+            invoices['invoice_date'] = pd.to_datetime(
+                invoices['invoice_date'], format=DATE_FORMAT, cache=True
+            )
+        # Optional dates are best-effort: any ISO 8601 variant, otherwise NaT
+        for column in ('order_date', 'due_date'):
+            if not is_datetime64_any_dtype(invoices[column]):
+                invoices[column] = pd.to_datetime(
+                    invoices[column], format='ISO8601', errors='coerce', cache=True
+                )
+        # A value the extraction gave as text must not turn the column into strings
+        for column in INVOICE_AMOUNT_COLUMNS:
+            if not is_numeric_dtype(invoices[column]):
+                invoices[column] = pd.to_numeric(invoices[column], errors='coerce')
+        
+        # Already in order (NaT, which sorts last, only at the end)?
+        dates = invoices['invoice_date']
+        n_dated = int(dates.notna().sum())
+        if dates.iloc[:n_dated].is_monotonic_increasing and dates.iloc[n_dated:].isna().all():
+            return invoices
+        return invoices.sort_values('invoice_date', kind='stable').reset_index(drop=True)
+    
+    @staticmethod
+    def _prepare_line_items(line_items: pd.DataFrame) -> pd.DataFrame:
+        """Make quantity and price columns numeric (unparseable values become NaN)"""
+        for column in LINE_ITEM_AMOUNT_COLUMNS:
+            if not is_numeric_dtype(line_items[column]):
+                line_items[column] = pd.to_numeric(line_items[column], errors='coerce')
+        return line_items
     
     def get_invoices_by_vendor(self, vendor_name: str, 
                                 start_date: Optional[str] = None, 
@@ -47,73 +311,82 @@ class InvoiceAnalyzer:
             DataFrame with invoice details
         """
         # Find vendor IDs matching the name
-        vendor_mask = self.vendors['name'].str.contains(vendor_name, case=False, na=False)
-        vendor_ids = self.vendors[vendor_mask]['vendor_id'].tolist()
+        vendor_mask = self._vendor_names_lower.str.contains(
+            vendor_name.lower(), regex=False, na=False
+        )
+        vendor_ids = self.vendors.loc[vendor_mask, 'vendor_id']
         
-        if not vendor_ids:
+        if vendor_ids.empty:
             print(f"⚠️  No vendors found matching: {vendor_name}")
             return pd.DataFrame()
         
-        # Filter invoices by vendor
-        result = self.invoices[self.invoices['vendor_id'].isin(vendor_ids)].copy()
+        # Restrict to the date range (a contiguous slice), then
+        # filter on categorical codes (small ints, no hashing)
+        in_range = self.invoices.iloc[self._date_slice(start_date, end_date)]
+        vendor_col = in_range['vendor_id']
+        matched_codes = vendor_col.cat.categories.get_indexer(vendor_ids)
+        invoice_codes = vendor_col.cat.codes.to_numpy()
+        if len(matched_codes) == 1:
+            # Common single-vendor case from the dashboard
+            mask = invoice_codes == matched_codes[0]
+        else:
+            mask = np.isin(invoice_codes, matched_codes)
         
-        # Apply date filters
-        if start_date:
-            result = result[result['invoice_date'] >= pd.to_datetime(start_date)]
-        if end_date:
-            result = result[result['invoice_date'] <= pd.to_datetime(end_date)]
+        result = in_range[mask].reset_index(drop=True)
         
-        # Join with vendor names
-        result = result.merge(
-            self.vendors[['vendor_id', 'name']], 
-            on='vendor_id', 
-            how='left'
-        ).rename(columns={'name': 'vendor_name'})
+        # Attach vendor names
+        result['vendor_name'] = result['vendor_id'].map(self._vendor_name)
+        
+        return result
+    
+    def get_invoices_by_date_range(self, start_date: str, end_date: str) -> pd.DataFrame:
+        """
+        List all invoices within a date range
+        
+        Args:
+            start_date: Start date (YYYY-MM-DD)
+            end_date: End date (YYYY-MM-DD)
+        
+        Returns:
+            DataFrame with invoice details and vendor names
+        """
+        result = self.invoices.iloc[self._date_slice(start_date, end_date)].reset_index(drop=True)
+        result['vendor_name'] = result['vendor_id'].map(self._vendor_name)
         
         return result
     
-    def get_total_spend_by_vendor(self) -> pd.DataFrame:
+    def get_total_spend_by_vendor(self, top_n: Optional[int] = None) -> pd.DataFrame:
         """
         Calculate total spend by vendor
         
+        Args:
+            top_n: Only return the top N vendors (None for the full ranking)
+        
         Returns:
             DataFrame with vendor names and total spend
         """
-        # Join invoices with vendors
-        vendor_spend = self.invoices.merge(
-            self.vendors[['vendor_id', 'name']], 
-            on='vendor_id', 
-            how='left'
-        )
-        
-        # Group by vendor and sum
-        summary = vendor_spend.groupby('name').agg({
-            'total': 'sum',
-            'invoice_id': 'count'
-        }).reset_index()
+        # Group by vendor name (names are looked up, not merged)
+        vendor_names = self.invoices['vendor_id'].map(self._vendor_name).rename('vendor_name')
         
-        summary.columns = ['vendor_name', 'total_spend', 'invoice_count']
-        summary = summary.sort_values('total_spend', ascending=False)
+        grouped = self.invoices.groupby(vendor_names)
+        summary = self._group_sum(grouped, ['total'], len(self.invoices))
+        summary.columns = ['total_spend']
+        summary['invoice_count'] = grouped.size()
+        summary = summary.reset_index()
         
-        return summary
+        return self._rank(summary, 'total_spend', top_n)
     
-    def get_total_spend_by_customer(self) -> pd.DataFrame:
-        """Calculate total spend by customer"""
-        customer_spend = self.invoices.merge(
-            self.customers[['customer_id', 'name']], 
-            on='customer_id', 
-            how='left'
-        )
+    def get_total_spend_by_customer(self, top_n: Optional[int] = None) -> pd.DataFrame:
+        """Calculate total spend by customer (top_n=None for the full ranking)"""
+        customer_names = self.invoices['customer_id'].map(self._customer_name).rename('customer_name')
         
-        summary = customer_spend.groupby('name').agg({
-            'total': 'sum',
-            'invoice_id': 'count'
-        }).reset_index()
+        grouped = self.invoices.groupby(customer_names)
+        summary = self._group_sum(grouped, ['total'], len(self.invoices))
+        summary.columns = ['total_spend']
+        summary['invoice_count'] = grouped.size()
+        summary = summary.reset_index()
         
-        summary.columns = ['customer_name', 'total_spend', 'invoice_count']
-        summary = summary.sort_values('total_spend', ascending=False)
-        
-        return summary
+        return self._rank(summary, 'total_spend', top_n)
     
     def get_top_products(self, top_n: int = 10) -> pd.DataFrame:
         """
@@ -125,50 +398,57 @@ class InvoiceAnalyzer:
         Returns:
             DataFrame with product details
         """
-        # Group by product and aggregate
-        product_summary = self.line_items.groupby(['product_id', 'description']).agg({
-            'quantity': 'sum',
-            'total_price': 'sum',
-            'line_item_id': 'count'
-        }).reset_index()
-        
-        product_summary.columns = ['product_id', 'description', 'total_quantity', 
-                                   'total_revenue', 'purchase_count']
-        
-        # Sort by purchase frequency
-        product_summary = product_summary.sort_values('purchase_count', ascending=False)
+        # Group by product id only; description is looked up per product
+        grouped = self.line_items.groupby('product_id', sort=False, observed=True)
+        product_summary = self._group_sum(
+            grouped, ['quantity', 'total_price'], len(self.line_items)
+        )
+        product_summary.columns = ['total_quantity', 'total_revenue']
+        product_summary['purchase_count'] = grouped.size()
+        product_summary.insert(
+            0, 'description', product_summary.index.map(self._product_desc)
+        )
         
-        return product_summary.head(top_n)
+        return self._rank(product_summary, 'purchase_count', top_n).reset_index()
     
     def get_invoice_details(self, invoice_number: str) -> Dict[str, Any]:
         """
         Get complete details for a specific invoice
         
+        Results are memoized per invoice number; treat them as read-only.
+        
         Args:
             invoice_number: Invoice number to lookup
         
         Returns:
-            Dictionary with invoice header and line items
+            Dictionary with invoice header and line items (as a DataFrame)
         """
-        # Find invoice
-        invoice = self.invoices[self.invoices['invoice_number'] == invoice_number]
-        
-        if invoice.empty:
+        details = self._invoice_details_cache.get(invoice_number)
+        if details is None:
+            details = self._build_invoice_details(invoice_number)
+            self._invoice_details_cache[invoice_number] = details
+        return details
+    
+    def _build_invoice_details(self, invoice_number: str) -> Dict[str, Any]:
+        """Look up the invoice header, vendor, customer and line items"""
+        # Find invoice (one hash probe; a miss raises instead of a separate membership test)
+        try:
+            invoice = self.invoices_by_number.loc[invoice_number]
+        except KeyError:
             return {"error": f"Invoice {invoice_number} not found"}
         
-        invoice = invoice.iloc[0]
         invoice_id = invoice['invoice_id']
         
         # Get vendor and customer
-        vendor = self.vendors[self.vendors['vendor_id'] == invoice['vendor_id']].iloc[0]
-        customer = self.customers[self.customers['customer_id'] == invoice['customer_id']].iloc[0]
+        vendor = self.vendors_by_id.loc[invoice['vendor_id']]
+        customer = self.customers_by_id.loc[invoice['customer_id']]
         
-        # Get line items
-        items = self.line_items[self.line_items['invoice_id'] == invoice_id]
+        # Get line items (binary search on the sorted index)
+        items = self.line_items_by_invoice.loc[invoice_id:invoice_id].reset_index(drop=True)
         
         return {
             "invoice_number": invoice['invoice_number'],
-            "invoice_date": invoice['invoice_date'].strftime('%Y-%m-%d'),
+            "invoice_date": invoice['invoice_date'].strftime(DATE_FORMAT),
             "total": float(invoice['total']),
             "vendor": {
                 "name": vendor['name'],
@@ -180,7 +460,7 @@ class InvoiceAnalyzer:
                 "address": customer['address'],
                 "phone": customer['phone']
             },
-            "line_items": items.to_dict('records'),
+            "line_items": items,
             "line_item_count": len(items)
         }
     
@@ -195,10 +475,7 @@ class InvoiceAnalyzer:
         Returns:
             Dictionary with summary statistics
         """
-        mask = (self.invoices['invoice_date'] >= pd.to_datetime(start_date)) & \
-               (self.invoices['invoice_date'] <= pd.to_datetime(end_date))
-        
-        filtered = self.invoices[mask]
+        filtered = self.invoices.iloc[self._date_slice(start_date, end_date)].reset_index(drop=True)
         
         return {
             "date_range": f"{start_date} to {end_date}",
@@ -219,8 +496,8 @@ class InvoiceAnalyzer:
         Returns:
             DataFrame with matching products
         """
-        mask = self.line_items['description'].str.contains(
-            search_term, case=False, na=False
+        mask = self._line_items_desc_lower.str.contains(
+            search_term.lower(), regex=False, na=False
         )
         
         results = self.line_items[mask].copy()
@@ -237,16 +514,21 @@ class InvoiceAnalyzer:
     
     def get_monthly_revenue(self) -> pd.DataFrame:
         """Get revenue by month"""
-        monthly = self.invoices.copy()
-        monthly['month'] = monthly['invoice_date'].dt.to_period('M')
+        first_month, offsets = self._invoice_months
+        totals = np.nan_to_num(
+            self.invoices['total'].to_numpy(dtype=np.float64)[:len(offsets)]
+        )
+        n_months = int(offsets.max()) + 1 if len(offsets) else 0
         
-        summary = monthly.groupby('month').agg({
-            'total': 'sum',
-            'invoice_id': 'count'
-        }).reset_index()
+        revenue, counts = _month_totals(offsets, totals, n_months)
         
-        summary.columns = ['month', 'revenue', 'invoice_count']
-        summary['month'] = summary['month'].astype(str)
+        # Drop months without invoices and rebuild the YYYY-MM labels from the offsets
+        present = np.flatnonzero(counts)
+        summary = pd.DataFrame({
+            'month': np.datetime_as_string(first_month + present, unit='M'),
+            'revenue': revenue[present],
+            'invoice_count': counts[present]
+        })
         
         return summary
     
@@ -298,8 +580,8 @@ def main():
     
     # Query 2: Total spend by vendor
     print("\n2️⃣ Total Spend by Vendor:")
-    vendor_spend = analyzer.get_total_spend_by_vendor()
-    print(vendor_spend.head(10))
+    vendor_spend = analyzer.get_total_spend_by_vendor(top_n=10)
+    print(vendor_spend)
     
     # Query 3: Top products
     print("\n3️⃣ Top 10 Most Purchased Products:")
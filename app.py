@@ -4,12 +4,11 @@ Streamlit web application for querying and analyzing invoices
 """
 
 import streamlit as st
-import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from analysis.queries import InvoiceAnalyzer
 from datetime import datetime
-import json
+import orjson
 
 # Page config
 st.set_page_config(
@@ -49,21 +48,26 @@ def load_data():
 
 analyzer = load_data()
 
-# Helper function for JSON serialization
-def convert_to_json_serializable(obj):
-    """Convert pandas/numpy types to native Python types for JSON serialization"""
-    if isinstance(obj, dict):
-        return {k: convert_to_json_serializable(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [convert_to_json_serializable(item) for item in obj]
-    elif hasattr(obj, 'item'):  # numpy/pandas scalar types
-        return obj.item()
-    elif hasattr(obj, 'tolist'):  # numpy arrays
-        return obj.tolist()
-    elif pd.isna(obj):  # Handle NaN values
-        return None
-    else:
-        return obj
+# Cached queries (the CSV data does not change while the app is running)
+@st.cache_data
+def cached_vendor_spend():
+    """Total spend by vendor (cached)"""
+    return analyzer.get_total_spend_by_vendor()
+
+@st.cache_data
+def cached_monthly_revenue():
+    """Revenue by month (cached)"""
+    return analyzer.get_monthly_revenue()
+
+@st.cache_data
+def cached_top_products(top_n: int):
+    """Top N products (cached per top_n)"""
+    return analyzer.get_top_products(top_n)
+
+@st.cache_data
+def cached_invoice_details(invoice_number):
+    """Invoice header and line items (cached per invoice number)"""
+    return analyzer.get_invoice_details(invoice_number)
 
 # Header
 st.markdown('<div class="main-header">📊 Invoice Extraction System</div>', unsafe_allow_html=True)
@@ -132,7 +136,7 @@ if page == "🏠 Dashboard":
     
     with col1:
         st.subheader("💰 Spend by Vendor")
-        vendor_spend = analyzer.get_total_spend_by_vendor()
+        vendor_spend = cached_vendor_spend()
         
         fig = px.bar(
             vendor_spend,
@@ -150,7 +154,7 @@ if page == "🏠 Dashboard":
     
     with col2:
         st.subheader("📈 Monthly Revenue Trend")
-        monthly = analyzer.get_monthly_revenue()
+        monthly = cached_monthly_revenue()
         
         fig = px.line(
             monthly,
@@ -170,7 +174,7 @@ if page == "🏠 Dashboard":
     
     # Top Products
     st.subheader("🏆 Top 10 Products")
-    top_products = analyzer.get_top_products(10)
+    top_products = cached_top_products(10)
     
     col1, col2 = st.columns([2, 1])
     
@@ -227,14 +231,10 @@ elif page == "📋 Query Invoices":
     if st.button("🔍 Search", type="primary"):
         if vendor_search == "All":
             # Filter by date only
-            mask = (analyzer.invoices['invoice_date'] >= pd.to_datetime(start_date)) & \
-                   (analyzer.invoices['invoice_date'] <= pd.to_datetime(end_date))
-            results = analyzer.invoices[mask].copy()
-            results = results.merge(
-                analyzer.vendors[['vendor_id', 'name']], 
-                on='vendor_id', 
-                how='left'
-            ).rename(columns={'name': 'vendor_name'})
+            results = analyzer.get_invoices_by_date_range(
+                str(start_date),
+                str(end_date)
+            )
         else:
             results = analyzer.get_invoices_by_vendor(
                 vendor_search,
@@ -281,7 +281,7 @@ elif page == "📦 Products":
     # Top N selector
     top_n = st.slider("Show Top N Products:", min_value=5, max_value=50, value=15, step=5)
     
-    top_products = analyzer.get_top_products(top_n)
+    top_products = cached_top_products(top_n)
     
     # Metrics
     col1, col2, col3, col4 = st.columns(4)
@@ -378,7 +378,7 @@ elif page == "📄 Invoice Lookup":
     )
     
     if st.button("🔍 Load Invoice", type="primary"):
-        details = analyzer.get_invoice_details(selected_invoice)
+        details = cached_invoice_details(selected_invoice)
         
         if "error" not in details:
             # Header
@@ -411,16 +411,20 @@ elif page == "📄 Invoice Lookup":
             
             # Line items
             st.subheader("📦 Line Items")
-            line_items_df = pd.DataFrame(details['line_items'])
+            line_items_df = details['line_items']
             st.dataframe(
                 line_items_df[['product_id', 'description', 'quantity', 'unit', 'unit_price', 'total_price']],
                 use_container_width=True,
                 hide_index=True
             )
             
-            # Download invoice as JSON (FIXED)
-            json_ready_details = convert_to_json_serializable(details)
-            json_str = json.dumps(json_ready_details, indent=2)
+            # Download invoice as JSON: orjson serializes the numpy/NaN header values,
+            # line items are embedded as-is from pandas' C JSON writer
+            json_str = orjson.dumps(
+                {**details, 'line_items': orjson.Fragment(line_items_df.to_json(orient='records'))},
+                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NAIVE_UTC | orjson.OPT_INDENT_2,
+                default=str
+            )
             
             st.download_button(
                 label="📥 Download Invoice JSON",
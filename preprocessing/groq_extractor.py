@@ -3,134 +3,382 @@ Stage 2: LLM-Based Field Extraction using Groq API
 Fast and accurate extraction with GPT-OSS 120B
 """
 
-from groq import Groq
+from groq import Groq, AsyncGroq, APIConnectionError, APIStatusError, RateLimitError
+import asyncio
+import contextlib
+import hashlib
+import httpx
+import itertools
+import logging
 import json
+import orjson
+import os
+import random
 import re
-from typing import Dict, Any
+import time
+from pathlib import Path
+from typing import AsyncIterator, Dict, Any, Optional
 from datetime import datetime
+from .rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Static instructions and output schema, sent as the system message so the
+# per-invoice user message carries only the OCR text
+_SYSTEM_PROMPT = """You are an expert invoice data extraction system. Extract ALL invoice data from the OCR text and return ONLY a valid JSON object with no additional text before or after.
+
+Return this EXACT JSON structure:
+{
+  "invoice_number": "string",
+  "order_number": "string or null",
+  "invoice_date": "YYYY-MM-DD",
+  "order_date": "YYYY-MM-DD or null",
+  "due_date": "YYYY-MM-DD or null",
+  "vendor": {
+    "name": "full company name",
+    "address": "complete address",
+    "phone": "phone or null",
+    "email": "email or null"
+  },
+  "customer": {
+    "name": "full customer name",
+    "address": "complete address",
+    "phone": "phone or null",
+    "customer_id": "id or null"
+  },
+  "amounts": {
+    "subtotal": 0.0,
+    "tax": 0.0,
+    "discount": 0.0,
+    "freight": 0.0,
+    "total": 0.0
+  },
+  "line_items": [
+    {
+      "product_id": "id or null",
+      "description": "full product name",
+      "quantity": 0.0,
+      "unit": "CS/EA/LB",
+      "unit_price": 0.0,
+      "total_price": 0.0
+    }
+  ],
+  "payment_terms": "terms",
+  "currency": "USD"
+}
+
+RULES:
+- Return ONLY the JSON object
+- No explanations or markdown
+- Use null for missing values (not "null" string)
+- All prices as numbers not strings
+- Extract ALL line items"""
+
+# OCR whitespace compression (fewer prompt tokens)
+_HSPACE_RE = re.compile(r'[ \t]+')
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+# Characters that matter when scanning for JSON object boundaries
+_JSON_SPECIAL_RE = re.compile(r'[{}"\\]')
+_TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+
+
+def _json_object_end(text: str, begin: int) -> Optional[int]:
+    """
+    End bound of the JSON object whose opening brace is at ``begin``
+    
+    A single linear scan tracking brace depth; braces inside JSON strings
+    (including escaped quotes) are ignored. Returns None if the object
+    does not close before the end of the text.
+    """
+    depth = 0
+    in_string = False
+    escaped = -1  # position of the character following a backslash
+    
+    for match in _JSON_SPECIAL_RE.finditer(text, begin):
+        pos = match.start()
+        if pos == escaped:
+            continue
+        char = match.group()
+        
+        if in_string:
+            if char == '\\':
+                escaped = pos + 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                return pos + 1
+    
+    return None
+
+
+def _loads_lenient(json_str: str) -> Any:
+    """json.loads allowing raw control characters in strings, retrying with trailing commas removed"""
+    try:
+        return json.loads(json_str, strict=False)
+    except json.JSONDecodeError:
+        return json.loads(_TRAILING_COMMA_RE.sub(r'\1', json_str), strict=False)
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Rate limits, timeouts, dropped connections and 5xx are transient; other 4xx are not"""
+    # APITimeoutError is a subclass of APIConnectionError
+    if isinstance(error, (RateLimitError, APIConnectionError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code >= 500 or _is_json_validation_error(error)
+    return True
+
+
+def _is_json_validation_error(error: APIStatusError) -> bool:
+    """JSON mode rejects a generation that is not valid JSON with a 400; a new sample may pass"""
+    body = error.body if isinstance(error.body, dict) else {}
+    details = body.get('error', body)
+    return isinstance(details, dict) and details.get('code') == 'json_validate_failed'
+
+
+def _estimate_tokens(request: Dict[str, Any]) -> int:
+    """Rough prompt token count (~4 characters per token) for rate limiting"""
+    return sum(len(message['content']) for message in request['messages']) // 4
+
+
+def _retry_after_seconds(error: Exception) -> Optional[float]:
+    """Server-requested wait from a Retry-After header, if any"""
+    if not isinstance(error, APIStatusError):
+        return None
+    try:
+        return float(error.response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
 
 
 class GroqExtractor:
     """Extract structured invoice data using Groq API"""
     
-    def __init__(self, api_key: str, model_name: str = "openai/gpt-oss-120b"):
+    def __init__(self, api_key: str, model_name: str = "openai/gpt-oss-120b",
+                 base_delay: float = 1.0, max_delay: float = 30.0, jitter: float = 0.5,
+                 call_timeout: float = 120.0, json_mode: bool = True,
+                 debug_dir: Optional[str] = None):
         """
         Initialize Groq extractor
         
         Args:
             api_key: Groq API key
             model_name: Model to use (openai/gpt-oss-120b recommended)
+            base_delay: First retry delay in seconds (doubles each attempt)
+            max_delay: Cap on the retry delay before jitter
+            jitter: Maximum random fraction added to each retry delay
+            call_timeout: Seconds before a single API call is abandoned (then retried)
+            json_mode: Request Groq JSON mode (guaranteed-valid JSON); turn off for
+                models without it to use the lenient response cleanup instead
+            debug_dir: Directory to save unparseable responses to (off when None)
         """
-        self.client = Groq(api_key=api_key)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.json_mode = json_mode
+        self.debug_dir = Path(debug_dir) if debug_dir else None
+        self._debug_seq = itertools.count()
+        
+        # Retries are handled here (with backoff), so the SDK's own are disabled.
+        # Explicit keep-alive HTTP/2 pools let back-to-back and concurrent
+        # requests share connections instead of paying a TLS handshake each.
+        self._api_key = api_key
+        self._timeout = httpx.Timeout(call_timeout, connect=10.0)
+        self._limits = httpx.Limits(max_connections=32, max_keepalive_connections=32)
+        self.client = Groq(
+            api_key=api_key, timeout=self._timeout, max_retries=0,
+            http_client=httpx.Client(http2=True, limits=self._limits, timeout=self._timeout)
+        )
+        # Async connections belong to one event loop, so the async client is
+        # opened per run by async_session() rather than here
+        self.aclient: Optional[AsyncGroq] = None
         self.model_name = model_name
-        print(f"   ⚡ Using Groq model: {model_name}")
+        logger.info(f"   ⚡ Using Groq model: {model_name}")
         
     def extract_invoice_data(self, ocr_text: str, max_retries: int = 3) -> Dict[str, Any]:
         """Extract structured invoice data from OCR text"""
-        prompt = self._create_extraction_prompt(ocr_text)
+        request = self._create_request(ocr_text)
+        
+        for attempt in range(max_retries):
+            try:
+                response = self.client.chat.completions.create(**request)
+                
+                result = self._handle_response(response, attempt)
+                
+                if not result.get('error'):
+                    return result
+                
+                if attempt < max_retries - 1:
+                    logger.info(f"   🔄 Retry {attempt + 1}/{max_retries}...")
+                    continue
+                    
+                return result
+                
+            except Exception as e:
+                logger.warning(f"   ❌ Groq API error: {e}")
+                if _is_retryable(e) and attempt < max_retries - 1:
+                    delay = self._backoff_delay(attempt, e)
+                    logger.info(f"   🔄 Retry {attempt + 1}/{max_retries} in {delay:.1f}s...")
+                    time.sleep(delay)
+                    continue
+                return self._create_error_result(str(e))
+        
+        return self._create_error_result("Max retries exceeded")
+    
+    def _new_async_client(self) -> AsyncGroq:
+        """AsyncGroq on its own HTTP/2 pool (usable only in the event loop it is first used in)"""
+        return AsyncGroq(
+            api_key=self._api_key, timeout=self._timeout, max_retries=0,
+            http_client=httpx.AsyncClient(http2=True, limits=self._limits, timeout=self._timeout)
+        )
+    
+    @contextlib.asynccontextmanager
+    async def async_session(self) -> AsyncIterator[AsyncGroq]:
+        """
+        Share one async client between the extract_invoice_data_async calls of a run
+        
+        Open it inside the event loop that makes the calls (e.g. around an
+        asyncio.gather); the connections are closed when the block exits, so a
+        later asyncio.run starts with a fresh client.
+        """
+        client = self._new_async_client()
+        self.aclient = client
+        try:
+            yield client
+        finally:
+            self.aclient = None
+            await client.close()
+    
+    async def extract_invoice_data_async(self, ocr_text: str, max_retries: int = 3,
+                                         rate_limiter: Optional[RateLimiter] = None) -> Dict[str, Any]:
+        """
+        Async version of extract_invoice_data (lets many requests be in flight at once)
+        
+        With a rate_limiter, every attempt (retries included) waits for request
+        and token budget; the estimate is corrected with the reported usage.
+        Outside async_session(), a client is opened for this call only.
+        """
+        if self.aclient is None:
+            async with self._new_async_client() as client:
+                return await self._extract_async(client, ocr_text, max_retries, rate_limiter)
+        return await self._extract_async(self.aclient, ocr_text, max_retries, rate_limiter)
+    
+    async def _extract_async(self, client: AsyncGroq, ocr_text: str, max_retries: int,
+                             rate_limiter: Optional[RateLimiter]) -> Dict[str, Any]:
+        """extract_invoice_data_async's retry loop on a given client"""
+        request = self._create_request(ocr_text)
+        estimated_tokens = _estimate_tokens(request)
         
         for attempt in range(max_retries):
             try:
-                response = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "You are an expert invoice data extraction system. You MUST return ONLY a valid JSON object with no additional text before or after."
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
-                    temperature=0.0,
-                    max_tokens=4096,
-                    top_p=1
-                )
+                if rate_limiter is not None:
+                    await rate_limiter.acquire(estimated_tokens)
                 
-                raw_response = response.choices[0].message.content
+                response = await client.chat.completions.create(**request)
                 
-                # Debug: Print first 200 chars of response
-                if attempt == 0:
-                    preview = raw_response[:200].replace('\n', ' ')
-                    print(f"   📝 Response preview: {preview}...")
+                if rate_limiter is not None and response.usage is not None:
+                    rate_limiter.consume(response.usage.total_tokens - estimated_tokens)
                 
-                result = self._parse_response(raw_response)
+                result = self._handle_response(response, attempt)
                 
                 if not result.get('error'):
                     return result
                 
                 if attempt < max_retries - 1:
-                    print(f"   🔄 Retry {attempt + 1}/{max_retries}...")
+                    logger.info(f"   🔄 Retry {attempt + 1}/{max_retries}...")
                     continue
                     
                 return result
                 
             except Exception as e:
-                print(f"   ❌ Groq API error: {e}")
-                if attempt < max_retries - 1:
-                    print(f"   🔄 Retry {attempt + 1}/{max_retries}...")
+                logger.warning(f"   ❌ Groq API error: {e}")
+                if _is_retryable(e) and attempt < max_retries - 1:
+                    delay = self._backoff_delay(attempt, e)
+                    logger.info(f"   🔄 Retry {attempt + 1}/{max_retries} in {delay:.1f}s...")
+                    await asyncio.sleep(delay)
                     continue
                 return self._create_error_result(str(e))
         
         return self._create_error_result("Max retries exceeded")
     
+    def _backoff_delay(self, attempt: int, error: Exception) -> float:
+        """Seconds to wait before the next attempt (exponential backoff with jitter)"""
+        retry_after = _retry_after_seconds(error)
+        if retry_after is not None:
+            return retry_after
+        
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay * (1 + random.uniform(0, self.jitter))
+    
+    def cache_key(self, ocr_text: str) -> str:
+        """SHA-256 of everything that determines an extraction (model, prompts, options, OCR text)"""
+        request = self._create_request(ocr_text)
+        return hashlib.sha256(orjson.dumps(request, option=orjson.OPT_SORT_KEYS)).hexdigest()
+    
+    def _create_request(self, ocr_text: str) -> Dict[str, Any]:
+        """Create chat completion arguments (shared by the sync and async clients)"""
+        prompt = self._create_extraction_prompt(ocr_text)
+        
+        request = {
+            "model": self.model_name,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": _SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "temperature": 0.0,
+            "max_tokens": 4096,
+            "top_p": 1
+        }
+        if self.json_mode:
+            request["response_format"] = {"type": "json_object"}
+        
+        return request
+    
+    def _handle_response(self, response, attempt: int) -> Dict[str, Any]:
+        """Parse a chat completion response"""
+        raw_response = response.choices[0].message.content
+        
+        # Debug: Print first 200 chars of response
+        if attempt == 0:
+            preview = raw_response[:200].replace('\n', ' ')
+            logger.debug(f"   📝 Response preview: {preview}...")
+        
+        if self.json_mode:
+            return self._parse_json_response(raw_response)
+        return self._parse_response(raw_response)
+    
+    def _parse_json_response(self, response_text: str) -> Dict[str, Any]:
+        """Parse a JSON mode response (already strict JSON, no cleanup needed)"""
+        try:
+            data = orjson.loads(response_text or '')
+        except orjson.JSONDecodeError as e:
+            logger.warning(f"   ⚠️  JSON parse failed: {e}")
+            self._save_debug_response(response_text or '')
+            return self._create_error_result(f"JSON parse error: {e}")
+        
+        if not isinstance(data, dict):
+            return self._create_error_result("Response is not a JSON object")
+        return data
+    
     def _create_extraction_prompt(self, ocr_text: str) -> str:
-        """Create extraction prompt"""
+        """Create the user message: whitespace-compressed OCR text (schema lives in the system prompt)"""
+        ocr_text = _BLANK_LINES_RE.sub('\n\n', _HSPACE_RE.sub(' ', ocr_text))
         ocr_snippet = ocr_text[:4000] if len(ocr_text) > 4000 else ocr_text
         
-        prompt = f"""Extract ALL invoice data from the OCR text and return ONLY a JSON object.
-
-OCR TEXT:
-{ocr_snippet}
-
-Return this EXACT JSON structure (no text before or after):
-{{
-  "invoice_number": "string",
-  "order_number": "string or null",
-  "invoice_date": "YYYY-MM-DD",
-  "order_date": "YYYY-MM-DD or null",
-  "due_date": "YYYY-MM-DD or null",
-  "vendor": {{
-    "name": "full company name",
-    "address": "complete address",
-    "phone": "phone or null",
-    "email": "email or null"
-  }},
-  "customer": {{
-    "name": "full customer name",
-    "address": "complete address",
-    "phone": "phone or null",
-    "customer_id": "id or null"
-  }},
-  "amounts": {{
-    "subtotal": 0.0,
-    "tax": 0.0,
-    "discount": 0.0,
-    "freight": 0.0,
-    "total": 0.0
-  }},
-  "line_items": [
-    {{
-      "product_id": "id or null",
-      "description": "full product name",
-      "quantity": 0.0,
-      "unit": "CS/EA/LB",
-      "unit_price": 0.0,
-      "total_price": 0.0
-    }}
-  ],
-  "payment_terms": "terms",
-  "currency": "USD"
-}}
-
-RULES:
-- Return ONLY the JSON object
-- No explanations or markdown
-- Use null for missing values (not "null" string)
-- All prices as numbers not strings
-- Extract ALL line items"""
-        return prompt
+        return f"OCR TEXT:\n{ocr_snippet}"
     
     def _parse_response(self, response_text: str) -> Dict[str, Any]:
         """Parse Groq response with aggressive cleanup"""
@@ -152,31 +400,26 @@ RULES:
         
         response_text = response_text.strip()
         
-        # Try to extract JSON object with regex
-        json_pattern = r'\{(?:[^{}]|(?:\{(?:[^{}]|(?:\{[^{}]*\}))*\}))*\}'
-        json_matches = re.findall(json_pattern, response_text, re.DOTALL)
-        
-        if json_matches:
-            # Try largest match first (most likely to be complete)
-            json_matches.sort(key=len, reverse=True)
-            
-            for json_str in json_matches:
+        # Take the first JSON object that has the key fields. A brace in prose
+        # may never close or parse, so every later '{' is a candidate start.
+        begin = response_text.find('{')
+        while begin != -1:
+            end = _json_object_end(response_text, begin)
+            if end is not None:
                 try:
-                    # Clean up common issues
-                    json_str = json_str.strip()
-                    
-                    # Fix trailing commas
-                    json_str = re.sub(r',(\s*[}\]])', r'\1', json_str)
-                    
-                    # Try to parse
-                    data = json.loads(json_str)
+                    data = _loads_lenient(response_text[begin:end])
                     
                     # Validate it has key fields
-                    if 'invoice_number' in data or 'vendor' in data:
+                    if isinstance(data, dict) and ('invoice_number' in data or 'vendor' in data):
                         return data
-                        
-                except json.JSONDecodeError:
+                    
+                    # Valid JSON without them; nothing nested inside can qualify
+                    begin = response_text.find('{', end)
                     continue
+                    
+                except json.JSONDecodeError:
+                    pass
+            begin = response_text.find('{', begin + 1)
         
         # If no valid JSON found, try the whole text
         try:
@@ -190,24 +433,35 @@ RULES:
             if end_idx > 0:
                 response_text = response_text[:end_idx + 1]
             
-            # Fix trailing commas
-            response_text = re.sub(r',(\s*[}\]])', r'\1', response_text)
-            
-            data = json.loads(response_text)
-            return data
+            return _loads_lenient(response_text)
             
         except json.JSONDecodeError as e:
-            print(f"   ⚠️  JSON parse failed: {e}")
-            print(f"   📄 Response length: {len(original_text)} chars")
+            logger.warning(f"   ⚠️  JSON parse failed: {e}")
+            logger.debug(f"   📄 Response length: {len(original_text)} chars")
             
-            # Save problematic response for debugging
-            debug_file = "debug_failed_response.txt"
-            with open(debug_file, 'w', encoding='utf-8') as f:
-                f.write(original_text)
-            print(f"   💾 Saved response to: {debug_file}")
+            self._save_debug_response(original_text)
             
             return self._create_error_result(f"JSON parse error: {e}")
     
+    def _save_debug_response(self, response_text: str):
+        """Save a problematic response for debugging (one new file per failure)"""
+        if self.debug_dir is None:
+            return
+        
+        self.debug_dir.mkdir(parents=True, exist_ok=True)
+        while True:
+            debug_file = self.debug_dir / f"fail_{int(time.time() * 1000)}_{os.getpid()}_{next(self._debug_seq)}.txt"
+            try:
+                # O_EXCL: never overwrite an earlier failure
+                fd = os.open(debug_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL)
+                break
+            except FileExistsError:
+                continue
+        
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(response_text)
+        logger.info(f"   💾 Saved response to: {debug_file}")
+    
     def _create_error_result(self, error_message: str) -> Dict[str, Any]:
         """Create error result structure"""
         return {
@@ -226,15 +480,15 @@ def validate_extracted_data(data: Dict[str, Any]) -> bool:
     
     for field in required_fields:
         if field not in data:
-            print(f"   ⚠️  Missing required field: {field}")
+            logger.warning(f"   ⚠️  Missing required field: {field}")
             return False
     
     if not isinstance(data.get('amounts', {}).get('total'), (int, float)):
-        print(f"   ⚠️  Invalid total amount")
+        logger.warning(f"   ⚠️  Invalid total amount")
         return False
     
     if not isinstance(data.get('line_items'), list) or len(data.get('line_items', [])) == 0:
-        print(f"   ⚠️  No line items found")
+        logger.warning(f"   ⚠️  No line items found")
         return False
     
     return True
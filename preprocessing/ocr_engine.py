@@ -10,17 +10,25 @@ import cv2
 import numpy as np
 from typing import Dict, List, Union
 from dataclasses import dataclass, asdict
+import logging
 import warnings
 warnings.filterwarnings('ignore')
 
+logger = logging.getLogger(__name__)
+
 @dataclass
 class OCRResult:
     """Store OCR results with metadata"""
     text: str
-    boxes: List
     confidence: float
     method: str
     line_level_data: List[Dict]
+    median_confidence: float = 0.0
+    
+    @property
+    def boxes(self) -> List:
+        """Line polygons (kept once, in line_level_data)"""
+        return [line['box'] for line in self.line_level_data]
     
     def to_dict(self):
         return asdict(self)
@@ -28,39 +36,75 @@ class OCRResult:
 class MultiStrategyOCR:
     """Two-tier OCR: PaddleOCR -> EasyOCR"""
     
-    def __init__(self, lang: str = 'en', use_gpu: bool = False):
+    def __init__(self, lang: str = 'en', use_gpu: bool = False,
+                 fallback_confidence: float = 0.7, usable_median_confidence: float = 0.6,
+                 usable_min_lines: int = 20, warmup: bool = True):
+        """
+        Args:
+            lang: OCR language
+            use_gpu: Run models on the GPU
+            fallback_confidence: Paddle mean confidence below which EasyOCR is tried
+            usable_median_confidence: ...unless the median line confidence is at least this
+            usable_min_lines: ...and Paddle found at least this many lines
+            warmup: Run one tiny inference per engine at load time so lazy
+                backend setup (CUDA context, kernel selection) is not charged
+                to the first invoice
+        """
         self.lang = lang
         self.use_gpu = use_gpu
+        self.fallback_confidence = fallback_confidence
+        self.usable_median_confidence = usable_median_confidence
+        self.usable_min_lines = usable_min_lines
         
-        print("🔧 Initializing OCR engines...")
+        logger.info("🔧 Initializing OCR engines...")
         
         # Initialize PaddleOCR
         try:
-            print("   Loading PaddleOCR...")
+            logger.info("   Loading PaddleOCR...")
             self.paddle_ocr = PaddleOCR(
                 use_angle_cls=True,
                 lang=lang,
                 show_log=False,
                 use_gpu=use_gpu
             )
-            print("   ✓ PaddleOCR ready")
+            logger.info("   ✓ PaddleOCR ready")
         except Exception as e:
-            print(f"   ✗ PaddleOCR failed: {e}")
+            logger.warning(f"   ✗ PaddleOCR failed: {e}")
             self.paddle_ocr = None
         
         # Initialize EasyOCR
         try:
-            print("   Loading EasyOCR...")
+            logger.info("   Loading EasyOCR...")
             self.easy_reader = easyocr.Reader([lang], gpu=use_gpu, verbose=False)
-            print("   ✓ EasyOCR ready")
+            logger.info("   ✓ EasyOCR ready")
         except Exception as e:
-            print(f"   ✗ EasyOCR failed: {e}")
+            logger.warning(f"   ✗ EasyOCR failed: {e}")
             self.easy_reader = None
         
         if not self.paddle_ocr and not self.easy_reader:
             raise RuntimeError("No OCR engines available!")
         
-        print("✓ OCR ready\n")
+        if warmup:
+            self._warmup()
+        
+        logger.info("✓ OCR ready")
+    
+    def _warmup(self):
+        """Run each engine once on a small synthetic text-like image"""
+        dummy = np.full((64, 256, 3), 255, dtype=np.uint8)
+        dummy[20:40, 20:200] = 0
+        
+        warmups = (
+            (self.paddle_ocr, lambda: self.paddle_ocr.ocr(dummy, cls=True)),
+            (self.easy_reader, lambda: self.easy_reader.readtext(dummy)),
+        )
+        for engine, run in warmups:
+            if engine is None:
+                continue
+            try:
+                run()
+            except Exception as e:
+                logger.debug(f"   OCR warmup skipped: {e}")
     
     def extract_text(self, image_input: Union[Image.Image, np.ndarray, str], 
                      strategy: str = 'auto') -> OCRResult:
@@ -70,8 +114,8 @@ class MultiStrategyOCR:
         if strategy == 'auto':
             result = self._paddle_extract(img_array)
             
-            if result.confidence < 0.7:
-                print(f"   ⚠️  Low confidence ({result.confidence:.2%}), trying EasyOCR...")
+            if self._needs_fallback(result):
+                logger.info(f"   ⚠️  Low confidence ({result.confidence:.2%}), trying EasyOCR...")
                 easy_result = self._easy_extract(img_array)
                 if easy_result.confidence > result.confidence:
                     result = easy_result
@@ -82,6 +126,21 @@ class MultiStrategyOCR:
             return self._paddle_extract(img_array)
         elif strategy == 'easy':
             return self._easy_extract(img_array)
+        else:
+            raise ValueError(f"Unknown OCR strategy: {strategy}")
+    
+    def _needs_fallback(self, result: OCRResult) -> bool:
+        """
+        Whether a Paddle result is poor enough to be worth an EasyOCR pass
+        
+        A low mean can come from a few uncertain words on an otherwise well-read
+        page; a long result with a high median is kept as is.
+        """
+        if result.confidence >= self.fallback_confidence:
+            return False
+        usable = (result.median_confidence >= self.usable_median_confidence
+                  and len(result.line_level_data) >= self.usable_min_lines)
+        return not usable
     
     def _prepare_image(self, image_input):
         """Convert input to numpy array"""
@@ -98,103 +157,73 @@ class MultiStrategyOCR:
     def _paddle_extract(self, img_array: np.ndarray) -> OCRResult:
         """Extract using PaddleOCR"""
         if self.paddle_ocr is None:
-            return OCRResult("", [], 0.0, "paddle_unavailable", [])
+            return OCRResult("", 0.0, "paddle_unavailable", [])
         
         try:
             result = self.paddle_ocr.ocr(img_array, cls=True)
             
             if not result or not result[0]:
-                return OCRResult("", [], 0.0, "paddle_no_text", [])
+                return OCRResult("", 0.0, "paddle_no_text", [])
             
-            full_text = []
-            boxes = []
-            confidences = []
-            line_data = []
-            
-            for line in result[0]:
-                box = line[0]
-                text = line[1][0]
-                conf = float(line[1][1])
-                
-                full_text.append(text)
-                boxes.append(box)
-                confidences.append(conf)
-                
-                line_data.append({
-                    'text': text,
-                    'box': [[float(p[0]), float(p[1])] for p in box],
-                    'confidence': conf,
-                    'bbox': self._get_bbox(box)
-                })
-            
-            avg_confidence = sum(confidences) / len(confidences) if confidences else 0.0
-            
-            return OCRResult(
-                text="\n".join(full_text),
-                boxes=boxes,
-                confidence=avg_confidence,
-                method="PaddleOCR",
-                line_level_data=line_data
+            lines = result[0]
+            return self._build_result(
+                texts=[line[1][0] for line in lines],
+                boxes=[line[0] for line in lines],
+                confidences=[line[1][1] for line in lines],
+                method="PaddleOCR"
             )
             
         except Exception as e:
-            print(f"   ✗ PaddleOCR error: {e}")
-            return OCRResult("", [], 0.0, "paddle_error", [])
+            logger.warning(f"   ✗ PaddleOCR error: {e}")
+            return OCRResult("", 0.0, "paddle_error", [])
     
     def _easy_extract(self, img_array: np.ndarray) -> OCRResult:
         """Extract using EasyOCR"""
         if self.easy_reader is None:
-            return OCRResult("", [], 0.0, "easy_unavailable", [])
+            return OCRResult("", 0.0, "easy_unavailable", [])
         
         try:
             result = self.easy_reader.readtext(img_array)
             
             if not result:
-                return OCRResult("", [], 0.0, "easy_no_text", [])
-            
-            full_text = []
-            boxes = []
-            confidences = []
-            line_data = []
+                return OCRResult("", 0.0, "easy_no_text", [])
             
-            for detection in result:
-                box = detection[0]
-                text = detection[1]
-                conf = float(detection[2])
-                
-                full_text.append(text)
-                boxes.append(box)
-                confidences.append(conf)
-                
-                line_data.append({
-                    'text': text,
-                    'box': [[float(p[0]), float(p[1])] for p in box],
-                    'confidence': conf,
-                    'bbox': self._get_bbox(box)
-                })
-            
-            avg_confidence = sum(confidences) / len(confidences) if confidences else 0.0
-            
-            return OCRResult(
-                text="\n".join(full_text),
-                boxes=boxes,
-                confidence=avg_confidence,
-                method="EasyOCR",
-                line_level_data=line_data
+            return self._build_result(
+                texts=[detection[1] for detection in result],
+                boxes=[detection[0] for detection in result],
+                confidences=[detection[2] for detection in result],
+                method="EasyOCR"
             )
             
         except Exception as e:
-            print(f"   ✗ EasyOCR error: {e}")
-            return OCRResult("", [], 0.0, "easy_error", [])
+            logger.warning(f"   ✗ EasyOCR error: {e}")
+            return OCRResult("", 0.0, "easy_error", [])
     
-    def _get_bbox(self, box: List) -> List[int]:
-        """Convert polygon to [x, y, width, height]"""
-        x_coords = [p[0] for p in box]
-        y_coords = [p[1] for p in box]
+    def _build_result(self, texts: List[str], boxes: List, confidences: List[float],
+                      method: str) -> OCRResult:
+        """Assemble an OCRResult, deriving per-line boxes and statistics with array ops"""
+        polygons = np.asarray(boxes, dtype=np.float64)  # (lines, 4 points, xy)
+        confs = np.asarray(confidences, dtype=np.float64)
+        
+        # Bounding boxes as [x, y, width, height], truncated like int(min), int(max - x)
+        origins = polygons.min(axis=1).astype(np.int64)
+        sizes = (polygons.max(axis=1) - origins).astype(np.int64)
+        bboxes = np.concatenate([origins, sizes], axis=1).tolist()
         
-        x = int(min(x_coords))
-        y = int(min(y_coords))
-        w = int(max(x_coords) - x)
-        h = int(max(y_coords) - y)
+        line_data = [
+            {
+                'text': text,
+                'box': box,
+                'confidence': conf,
+                'bbox': bbox
+            }
+            for text, box, conf, bbox in zip(texts, polygons.tolist(), confs.tolist(), bboxes)
+        ]
         
-        return [x, y, w, h]
+        return OCRResult(
+            text="\n".join(texts),
+            confidence=float(confs.mean()),
+            method=method,
+            line_level_data=line_data,
+            median_confidence=float(np.median(confs))
+        )
@@ -4,58 +4,84 @@ No Poppler installation required!
 """
 
 import fitz  # PyMuPDF
-from PIL import Image
-from typing import List
+import cv2
+import numpy as np
+from typing import Iterator, List
+import logging
 import os
-import io
+
+logger = logging.getLogger(__name__)
 
 class PDFProcessor:
     """Convert PDF documents to images using PyMuPDF"""
     
-    def __init__(self, dpi: int = 300):
+    def __init__(self, dpi: int = 200, grayscale: bool = True):
         """
         Args:
-            dpi: Resolution for image conversion (300 recommended for OCR)
+            dpi: Resolution for image conversion (200 is enough for typical
+                invoice print; raise it for small or faint text)
+            grayscale: Render single-channel pages (a third of the RGB bytes;
+                both OCR engines accept grayscale input)
         """
         self.dpi = dpi
+        self.grayscale = grayscale
         self.zoom = dpi / 72  # PDF default DPI is 72
     
-    def pdf_to_images(self, pdf_path: str) -> List[Image.Image]:
+    def pdf_to_images(self, pdf_path: str) -> List[np.ndarray]:
         """
-        Convert PDF to list of PIL Images
+        Convert PDF to list of images
         
         Args:
             pdf_path: Path to PDF file
             
         Returns:
-            List of PIL Image objects (one per page)
+            List of page images (see iter_pages)
         """
-        try:
-            doc = fitz.open(pdf_path)
-            images = []
+        return list(self.iter_pages(pdf_path))
+    
+    def iter_pages(self, pdf_path: str, first_page_only: bool = False) -> Iterator[np.ndarray]:
+        """
+        Render PDF pages one at a time
+        
+        Only the current page's pixels are held in memory. Pixmaps are wrapped
+        as arrays directly (no PNG encode/decode round trip).
+        
+        Args:
+            pdf_path: Path to PDF file
+            first_page_only: Stop after the first page
             
-            for page_num in range(len(doc)):
-                page = doc[page_num]
+        Yields:
+            uint8 arrays, one per page: (height, width) when grayscale,
+            otherwise BGR (height, width, 3), ready for OpenCV-style OCR input
+        """
+        try:
+            with fitz.open(pdf_path) as doc:
+                num_pages = min(len(doc), 1) if first_page_only else len(doc)
                 
                 # Create transformation matrix for DPI
                 mat = fitz.Matrix(self.zoom, self.zoom)
+                colorspace = fitz.csGRAY if self.grayscale else fitz.csRGB
                 
-                # Render page to pixmap
-                pix = page.get_pixmap(matrix=mat, alpha=False)
-                
-                # Convert to PIL Image
-                img_data = pix.tobytes("png")
-                img = Image.open(io.BytesIO(img_data))
-                
-                images.append(img)
-            
-            doc.close()
-            return images
+                for page_num in range(num_pages):
+                    # Render page to pixmap
+                    pix = doc[page_num].get_pixmap(matrix=mat, alpha=False, colorspace=colorspace)
+                    
+                    # View the raw samples as an array (RGB is converted to BGR)
+                    samples = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+                    if self.grayscale:
+                        yield samples[:, :, 0]
+                    else:
+                        yield cv2.cvtColor(samples, cv2.COLOR_RGB2BGR)
             
         except Exception as e:
-            print(f"✗ Error converting PDF {pdf_path}: {e}")
+            logger.error(f"✗ Error converting PDF {pdf_path}: {e}")
             raise
     
+    def page_count(self, pdf_path: str) -> int:
+        """Number of pages (reads the page tree, renders nothing)"""
+        with fitz.open(pdf_path) as doc:
+            return len(doc)
+    
     def get_pdf_info(self, pdf_path: str) -> dict:
         """Get PDF metadata"""
         doc = fitz.open(pdf_path)
@@ -0,0 +1,76 @@
+"""
+Request and token rate limiting for API calls
+"""
+
+import asyncio
+import time
+from typing import Optional
+
+# Budget a bucket may accumulate (and starts with): a few seconds' worth, so
+# a fresh or idle limiter cannot fire a full minute of calls at once
+BURST_SECONDS = 5.0
+
+
+class _Bucket:
+    """Token bucket holding up to BURST_SECONDS of budget, refilled continuously"""
+    
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0  # refill per second
+        self.capacity = max(1.0, self.rate * BURST_SECONDS)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+    
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait_time(self, amount: float) -> float:
+        """Seconds until ``amount`` is available (requests larger than the bucket wait for a full one)"""
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+
+class RateLimiter:
+    """
+    Requests-per-minute and tokens-per-minute limits as token buckets
+    
+    Calls go ahead immediately while budget remains and wait only as long as
+    needed once it runs out, so time spent on slow calls is not slept again.
+    Each call reserves its budget before sleeping (levels may go negative),
+    so waiting callers queue up behind one another without holding the lock.
+    """
+    
+    def __init__(self, requests_per_minute: Optional[float] = None,
+                 tokens_per_minute: Optional[float] = None):
+        """
+        Args:
+            requests_per_minute: Maximum API calls per minute (None: unlimited)
+            tokens_per_minute: Maximum prompt + completion tokens per minute (None: unlimited)
+        """
+        self._requests = _Bucket(requests_per_minute) if requests_per_minute else None
+        self._tokens = _Bucket(tokens_per_minute) if tokens_per_minute else None
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self, tokens: int = 0):
+        """Reserve one request and ``tokens`` tokens, then wait until they fit in the budget"""
+        async with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            for bucket, amount in ((self._requests, 1), (self._tokens, tokens)):
+                if bucket is not None:
+                    bucket.refill(now)
+                    wait = max(wait, bucket.wait_time(amount))
+                    bucket.level -= amount
+        
+        if wait > 0:
+            await asyncio.sleep(wait)
+    
+    def consume(self, tokens: int):
+        """
+        Adjust the token budget after a call
+        
+        Positive values charge usage beyond what was acquired; negative values
+        return an over-estimate.
+        """
+        if self._tokens is not None:
+            self._tokens.refill(time.monotonic())
+            self._tokens.level -= tokens
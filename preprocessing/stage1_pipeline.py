@@ -5,15 +5,132 @@ Processes ALL PDFs in data/ folder
 
 from .pdf_processor import PDFProcessor
 from .ocr_engine import MultiStrategyOCR, OCRResult
-from typing import List, Dict
-import json
+from concurrent.futures import ProcessPoolExecutor
+from functools import cached_property, lru_cache
+from typing import List, Dict, Optional
+from tqdm import tqdm
+from tqdm.contrib.logging import logging_redirect_tqdm
+import logging
+import multiprocessing
+import orjson
 import os
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+# Pretty-printed like the former json.dump(indent=2); OCR engines may hand back numpy scalars
+JSON_OPTIONS = orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+@lru_cache(maxsize=4)
+def _get_ocr(lang: str, use_gpu: bool) -> MultiStrategyOCR:
+    """
+    OCR engines shared by every pipeline in this process
+    
+    Loading the Paddle and EasyOCR models takes seconds and hundreds of MB,
+    so it happens once per (lang, use_gpu).
+    """
+    return MultiStrategyOCR(lang=lang, use_gpu=use_gpu)
+
+
+# Per-worker engines for parallel batches (loaded once per worker process)
+_worker_pdf_processor: Optional[PDFProcessor] = None
+_worker_ocr_engine: Optional[MultiStrategyOCR] = None
+
+
+def _init_worker(dpi: int, grayscale: bool, use_gpu: bool, log_level: int = logging.WARNING):
+    """ProcessPoolExecutor initializer: load the PDF renderer and OCR models"""
+    global _worker_pdf_processor, _worker_ocr_engine
+    # Spawned workers start with unconfigured logging; match the parent's level
+    logging.basicConfig(level=log_level, format="%(message)s")
+    _worker_pdf_processor = PDFProcessor(dpi=dpi, grayscale=grayscale)
+    _worker_ocr_engine = _get_ocr('en', use_gpu)
+
+
+def _process_in_worker(pdf_path: str, output_dir: str) -> Dict:
+    """Process one invoice with this worker's engines"""
+    if _worker_pdf_processor is None or _worker_ocr_engine is None:
+        raise RuntimeError("Worker engines not loaded; _init_worker did not run")
+    return _process_invoice(_worker_pdf_processor, _worker_ocr_engine, pdf_path, output_dir)
+
+
+def _process_invoice(pdf_processor: PDFProcessor, ocr_engine: MultiStrategyOCR,
+                     pdf_path: str, output_dir: str = "stage1_output") -> Dict:
+    """Process one invoice: PDF -> images -> OCR -> Stage 1 JSON"""
+    
+    filename = os.path.basename(pdf_path)
+    
+    start_time = datetime.now()
+    
+    try:
+        # Render only the first page (the one that is OCR'd)
+        images = list(pdf_processor.iter_pages(pdf_path, first_page_only=True))
+        
+        if not images:
+            raise ValueError("No images extracted")
+        first_image = images[0]
+        
+        # Run OCR
+        ocr_result = ocr_engine.extract_text(first_image, strategy='auto')
+        
+        processing_time = (datetime.now() - start_time).total_seconds()
+        
+        # Prepare output
+        output_data = {
+            'metadata': {
+                'filename': filename,
+                'file_path': pdf_path,
+                'processing_date': datetime.now().isoformat(),
+                'processing_time_seconds': round(processing_time, 2),
+                'num_pages': pdf_processor.page_count(pdf_path),
+                'image_size': [first_image.shape[1], first_image.shape[0]]  # [width, height]
+            },
+            'ocr_results': {
+                'method': ocr_result.method,
+                'confidence': round(ocr_result.confidence, 4),
+                'num_lines': len(ocr_result.line_level_data),
+                'raw_text': ocr_result.text,
+                'line_level_data': ocr_result.line_level_data
+            }
+        }
+        
+        # Save to JSON
+        os.makedirs(output_dir, exist_ok=True)
+        output_file = os.path.join(
+            output_dir,
+            f"{os.path.splitext(filename)[0]}_stage1.json"
+        )
+        
+        with open(output_file, 'wb') as f:
+            f.write(orjson.dumps(output_data, option=JSON_OPTIONS))
+        
+        logger.info(f"📄 {filename} ✓ ({ocr_result.method}, {ocr_result.confidence:.2%}, {processing_time:.1f}s)")
+        
+        return output_data
+        
+    except Exception as e:
+        logger.warning(f"📄 {filename} ✗ FAILED: {e}")
+        return {
+            'metadata': {
+                'filename': filename,
+                'error': str(e),
+                'processing_date': datetime.now().isoformat()
+            }
+        }
+
+
 class Stage1Pipeline:
     """Complete Stage 1: PDF -> Images -> OCR"""
     
-    def __init__(self, use_gpu: bool = False):
+    def __init__(self, use_gpu: bool = False, max_workers: Optional[int] = None,
+                 dpi: int = 200, grayscale: bool = True):
+        """
+        Args:
+            use_gpu: Run OCR models on the GPU
+            max_workers: Worker processes for batch runs (default: half the CPU
+                cores; always 1 on GPU, where workers would contend for memory)
+            dpi: Page render resolution (raise for invoices with small, faint text)
+            grayscale: Render pages single-channel
+        """
         print("="*70)
         print("🚀 STAGE 1: Document Ingestion & OCR Pipeline")
         print("="*70)
@@ -21,71 +138,23 @@ class Stage1Pipeline:
         print("✓ Pure Python - No Tesseract")
         print("="*70 + "\n")
         
-        self.pdf_processor = PDFProcessor(dpi=300)
-        self.ocr_engine = MultiStrategyOCR(lang='en', use_gpu=use_gpu)
+        self.use_gpu = use_gpu
+        if use_gpu:
+            max_workers = 1
+        elif max_workers is None:
+            max_workers = max(1, (os.cpu_count() or 2) // 2)
+        self.max_workers = max_workers
+        
+        self.pdf_processor = PDFProcessor(dpi=dpi, grayscale=grayscale)
+    
+    @cached_property
+    def ocr_engine(self) -> MultiStrategyOCR:
+        """OCR models, loaded on first in-process use (parallel batches load them in workers)"""
+        return _get_ocr('en', self.use_gpu)
     
     def process_single_invoice(self, pdf_path: str, output_dir: str = "stage1_output") -> Dict:
         """Process one invoice"""
-        
-        filename = os.path.basename(pdf_path)
-        print(f"📄 {filename}... ", end='', flush=True)
-        
-        start_time = datetime.now()
-        
-        try:
-            # Convert PDF to images
-            images = self.pdf_processor.pdf_to_images(pdf_path)
-            
-            if not images:
-                raise ValueError("No images extracted")
-            
-            # Run OCR
-            ocr_result = self.ocr_engine.extract_text(images[0], strategy='auto')
-            
-            processing_time = (datetime.now() - start_time).total_seconds()
-            
-            # Prepare output
-            output_data = {
-                'metadata': {
-                    'filename': filename,
-                    'file_path': pdf_path,
-                    'processing_date': datetime.now().isoformat(),
-                    'processing_time_seconds': round(processing_time, 2),
-                    'num_pages': len(images),
-                    'image_size': list(images[0].size)
-                },
-                'ocr_results': {
-                    'method': ocr_result.method,
-                    'confidence': round(ocr_result.confidence, 4),
-                    'num_lines': len(ocr_result.line_level_data),
-                    'raw_text': ocr_result.text,
-                    'line_level_data': ocr_result.line_level_data
-                }
-            }
-            
-            # Save to JSON
-            os.makedirs(output_dir, exist_ok=True)
-            output_file = os.path.join(
-                output_dir,
-                f"{os.path.splitext(filename)[0]}_stage1.json"
-            )
-            
-            with open(output_file, 'w', encoding='utf-8') as f:
-                json.dump(output_data, f, indent=2, ensure_ascii=False)
-            
-            print(f"✓ ({ocr_result.method}, {ocr_result.confidence:.2%}, {processing_time:.1f}s)")
-            
-            return output_data
-            
-        except Exception as e:
-            print(f"✗ FAILED: {e}")
-            return {
-                'metadata': {
-                    'filename': filename,
-                    'error': str(e),
-                    'processing_date': datetime.now().isoformat()
-                }
-            }
+        return _process_invoice(self.pdf_processor, self.ocr_engine, pdf_path, output_dir)
     
     def process_all_invoices(self, data_folder: str = "data", output_dir: str = "stage1_output") -> List[Dict]:
         """
@@ -116,28 +185,31 @@ class Stage1Pipeline:
         success_count = 0
         start_time = datetime.now()
         
-        # Process each PDF
-        for i, pdf_file in enumerate(pdf_files, 1):
-            print(f"[{i:3d}/{len(pdf_files)}] ", end='')
-            
-            pdf_path = os.path.join(data_folder, pdf_file)
-            
-            try:
-                result = self.process_single_invoice(pdf_path, output_dir)
-                
-                if 'error' not in result.get('metadata', {}):
-                    success_count += 1
-                
-                results.append(result)
-                
-            except Exception as e:
-                print(f"✗ FAILED: {e}")
-                results.append({
-                    'metadata': {
-                        'filename': pdf_file,
-                        'error': str(e)
-                    }
-                })
+        if self.max_workers > 1 and len(pdf_files) > 1:
+            results = self._process_parallel(data_folder, pdf_files, output_dir)
+            success_count = sum('error' not in r.get('metadata', {}) for r in results)
+        else:
+            # Process each PDF
+            with logging_redirect_tqdm():
+                for pdf_file in tqdm(pdf_files, desc="Stage 1", unit="pdf"):
+                    pdf_path = os.path.join(data_folder, pdf_file)
+                    
+                    try:
+                        result = self.process_single_invoice(pdf_path, output_dir)
+                        
+                        if 'error' not in result.get('metadata', {}):
+                            success_count += 1
+                        
+                        results.append(result)
+                        
+                    except Exception as e:
+                        logger.error(f"📄 {pdf_file} ✗ FAILED: {e}")
+                        results.append({
+                            'metadata': {
+                                'filename': pdf_file,
+                                'error': str(e)
+                            }
+                        })
         
         total_time = (datetime.now() - start_time).total_seconds()
         
@@ -157,8 +229,8 @@ class Stage1Pipeline:
         }
         
         summary_file = os.path.join(output_dir, "batch_summary.json")
-        with open(summary_file, 'w', encoding='utf-8') as f:
-            json.dump(summary, f, indent=2, ensure_ascii=False)
+        with open(summary_file, 'wb') as f:
+            f.write(orjson.dumps(summary, option=JSON_OPTIONS))
         
         # Print summary
         print(f"\n{'='*70}")
@@ -173,3 +245,26 @@ class Stage1Pipeline:
         print(f"{'='*70}\n")
         
         return results
+    
+    def _process_parallel(self, data_folder: str, pdf_files: List[str], output_dir: str) -> List[Dict]:
+        """
+        Process PDFs across worker processes
+        
+        Workers are spawned rather than forked (Paddle and EasyOCR are not
+        fork-safe) and each loads its own OCR models once. Per-file failures
+        are reported by the workers.
+        """
+        workers = min(self.max_workers, len(pdf_files))
+        print(f"⚙️  Using {workers} worker processes\n")
+        
+        pdf_paths = [os.path.join(data_folder, f) for f in pdf_files]
+        
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.pdf_processor.dpi, self.pdf_processor.grayscale, self.use_gpu,
+                      logger.getEffectiveLevel())
+        ) as executor:
+            outputs = executor.map(_process_in_worker, pdf_paths, [output_dir] * len(pdf_paths), chunksize=1)
+            return list(tqdm(outputs, total=len(pdf_paths), desc="Stage 1", unit="pdf"))
@@ -2,18 +2,37 @@
 Stage 2 Pipeline using Groq API
 """
 
-import json
+import asyncio
+import ijson
+import logging
+import orjson
 import time
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, Optional
+from tqdm import tqdm
+from tqdm.contrib.logging import logging_redirect_tqdm
 from .groq_extractor import GroqExtractor, validate_extracted_data
+from .rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+# The only Stage 1 fields Stage 2 reads (line_level_data is never needed)
+STAGE1_FIELDS = (
+    'metadata.filename',
+    'metadata.processing_date',
+    'ocr_results.confidence',
+    'ocr_results.raw_text',
+)
 
 
 class GroqStage2Pipeline:
     """Complete Stage 2 pipeline using Groq API"""
     
     def __init__(self, api_key: str, model_name: str = "openai/gpt-oss-120b", 
-                 output_dir: str = "stage2_output", delay_seconds: int = 2):
+                 output_dir: str = "stage2_output", delay_seconds: int = 2,
+                 max_concurrency: int = 8, cache_dir: Optional[str] = "stage2_cache",
+                 cache_ttl_seconds: Optional[float] = None,
+                 tokens_per_minute: Optional[int] = None):
         """
         Initialize Groq pipeline
         
@@ -21,106 +40,223 @@ class GroqStage2Pipeline:
             api_key: Groq API key
             model_name: Groq model to use
             output_dir: Directory to save Stage 2 results
-            delay_seconds: Seconds to wait between API calls
+            delay_seconds: Average seconds between API calls (sets the requests-per-minute limit)
+            max_concurrency: Maximum number of Groq requests in flight at once
+            cache_dir: Directory of successful extractions keyed by content hash,
+                so re-processing an unchanged invoice skips Groq (None disables)
+            cache_ttl_seconds: Ignore cached extractions older than this (None: never expire)
+            tokens_per_minute: Groq tokens-per-minute limit to stay under (None: unlimited)
         """
         self.extractor = GroqExtractor(api_key, model_name)
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
         self.delay_seconds = delay_seconds
+        self.max_concurrency = max_concurrency
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if self.cache_dir:
+            self.cache_dir.mkdir(exist_ok=True)
+        self.cache_ttl_seconds = cache_ttl_seconds
+        self.tokens_per_minute = tokens_per_minute
         
     def process_stage1_output(self, stage1_json_path: str) -> Dict[str, Any]:
         """Process a single Stage 1 JSON file"""
-        print(f"\n📄 Processing: {Path(stage1_json_path).name}")
-        
-        with open(stage1_json_path, 'r', encoding='utf-8') as f:
-            stage1_data = json.load(f)
+        logger.info(f"📄 Processing: {Path(stage1_json_path).name}")
         
+        stage1_data = self._load_stage1(stage1_json_path)
         ocr_text = stage1_data['ocr_results']['raw_text']
         
-        print(f"   🤖 Extracting with Groq...")
-        extracted_data = self.extractor.extract_invoice_data(ocr_text)
-        
-        if validate_extracted_data(extracted_data):
-            print(f"   ✅ Extraction successful!")
+        cache_key = self.extractor.cache_key(ocr_text)
+        extracted_data = self._load_cached(cache_key)
+        if extracted_data is not None:
+            logger.info(f"   ♻️  Using cached extraction")
         else:
-            print(f"   ⚠️  Extraction completed with warnings")
+            logger.debug(f"   🤖 Extracting with Groq...")
+            extracted_data = self.extractor.extract_invoice_data(ocr_text)
+            self._store_cached(cache_key, extracted_data)
         
-        result = {
-            "metadata": {
-                "source_file": stage1_data['metadata']['filename'],
-                "stage1_confidence": stage1_data['ocr_results']['confidence'],
-                "processed_at": stage1_data['metadata']['processing_date']
-            },
-            "invoice_data": extracted_data
-        }
+        result = self._build_result(stage1_data, extracted_data)
         
         output_path = self._save_result(result, stage1_json_path)
-        print(f"   💾 Saved to: {output_path.name}")
+        logger.debug(f"   💾 Saved to: {output_path.name}")
+        
+        return result
+    
+    async def process_stage1_output_async(self, stage1_json_path: str,
+                                          limiter: Optional[RateLimiter] = None) -> Dict[str, Any]:
+        """Async version of process_stage1_output (file I/O runs in worker threads)"""
+        logger.info(f"📄 Processing: {Path(stage1_json_path).name}")
+        
+        stage1_data = await asyncio.to_thread(self._load_stage1, stage1_json_path)
+        ocr_text = stage1_data['ocr_results']['raw_text']
+        
+        cache_key = self.extractor.cache_key(ocr_text)
+        extracted_data = await asyncio.to_thread(self._load_cached, cache_key)
+        if extracted_data is not None:
+            logger.info(f"   ♻️  Using cached extraction")
+        else:
+            logger.debug(f"   🤖 Extracting with Groq...")
+            extracted_data = await self.extractor.extract_invoice_data_async(ocr_text, rate_limiter=limiter)
+            await asyncio.to_thread(self._store_cached, cache_key, extracted_data)
+        
+        result = self._build_result(stage1_data, extracted_data)
+        
+        output_path = await asyncio.to_thread(self._save_result, result, stage1_json_path)
+        logger.debug(f"   💾 Saved to: {output_path.name}")
         
         return result
     
     def process_batch(self, stage1_output_dir: str) -> Dict[str, Any]:
         """Process all Stage 1 JSON files with rate limiting"""
+        return asyncio.run(self.process_batch_async(stage1_output_dir))
+    
+    async def process_batch_async(self, stage1_output_dir: str) -> Dict[str, Any]:
+        """
+        Process all Stage 1 JSON files concurrently
+        
+        Up to ``max_concurrency`` requests are in flight at once. Calls are
+        budgeted by a requests-per-minute bucket (60 / ``delay_seconds``) and
+        an optional tokens-per-minute bucket, so they only wait when a limit
+        would actually be exceeded.
+        """
         stage1_dir = Path(stage1_output_dir)
         json_files = list(stage1_dir.glob("*.json"))
         
         print(f"\n🚀 Stage 2: LLM-Based Field Extraction (GROQ)")
         print(f"   Found {len(json_files)} Stage 1 outputs")
         print(f"   Output directory: {self.output_dir}")
+        print(f"   Concurrency: {self.max_concurrency} requests in flight")
         print(f"   Rate limiting: {self.delay_seconds} seconds between requests")
         
-        total_files = len([f for f in json_files if f.name != "batch_summary.json"])
+        for json_file in json_files:
+            if json_file.name == "batch_summary.json":
+                print(f"   ⏭️  Skipping: {json_file.name}")
+        json_files = [f for f in json_files if f.name != "batch_summary.json"]
+        
+        total_files = len(json_files)
         estimated_minutes = (total_files * self.delay_seconds) // 60
         print(f"   Estimated time: ~{estimated_minutes} minutes")
         
-        results = {
-            "total": 0,
-            "successful": 0,
-            "failed": 0,
-            "files": []
-        }
+        limiter = RateLimiter(
+            requests_per_minute=60 / self.delay_seconds if self.delay_seconds > 0 else None,
+            tokens_per_minute=self.tokens_per_minute
+        )
+        semaphore = asyncio.Semaphore(self.max_concurrency)
         
-        for idx, json_file in enumerate(json_files, 1):
-            if json_file.name == "batch_summary.json":
-                print(f"   ⏭️  Skipping: {json_file.name}")
-                continue
-            
-            results['total'] += 1
-            
-            try:
-                result = self.process_stage1_output(str(json_file))
-                
-                if result['invoice_data'].get('error'):
-                    results['failed'] += 1
-                else:
-                    results['successful'] += 1
-                    
-                results['files'].append({
-                    "file": json_file.name,
-                    "status": "success" if not result['invoice_data'].get('error') else "failed"
-                })
-                
-                # Rate limiting
-                remaining = total_files - results['total']
-                if remaining > 0:
-                    print(f"   ⏸️  Waiting {self.delay_seconds}s... ({results['successful']} successful, {results['failed']} failed)")
-                    time.sleep(self.delay_seconds)
-                
-            except Exception as e:
-                print(f"   ❌ Error: {e}")
-                results['failed'] += 1
-                results['files'].append({
+        progress = tqdm(total=total_files, desc="Stage 2", unit="invoice")
+        
+        async def process_file(json_file: Path) -> Dict[str, Any]:
+            async with semaphore:
+                try:
+                    return await self.process_stage1_output_async(str(json_file), limiter)
+                finally:
+                    progress.update(1)
+        
+        # One async client per run: its connections belong to this event loop
+        async with self.extractor.async_session():
+            with logging_redirect_tqdm(), progress:
+                outcomes = await asyncio.gather(
+                    *(process_file(json_file) for json_file in json_files),
+                    return_exceptions=True
+                )
+        
+        successful = 0
+        failed = 0
+        files: List[Dict[str, str]] = []
+        
+        for json_file, outcome in zip(json_files, outcomes):
+            if isinstance(outcome, BaseException):
+                logger.error(f"   ❌ Error ({json_file.name}): {outcome}")
+                failed += 1
+                files.append({
                     "file": json_file.name,
                     "status": "error",
-                    "error": str(e)
+                    "error": str(outcome)
                 })
-                time.sleep(self.delay_seconds + 3)
+                continue
+            
+            if outcome['invoice_data'].get('error'):
+                failed += 1
+            else:
+                successful += 1
+                
+            files.append({
+                "file": json_file.name,
+                "status": "success" if not outcome['invoice_data'].get('error') else "failed"
+            })
         
+        total = len(json_files)
         print(f"\n✅ Stage 2 Complete:")
-        print(f"   Successful: {results['successful']}/{results['total']}")
-        print(f"   Failed: {results['failed']}/{results['total']}")
+        print(f"   Successful: {successful}/{total}")
+        print(f"   Failed: {failed}/{total}")
+        
+        return {
+            "total": total,
+            "successful": successful,
+            "failed": failed,
+            "files": files
+        }
+    
+    def _load_stage1(self, stage1_json_path: str) -> Dict[str, Any]:
+        """
+        Load the STAGE1_FIELDS of a Stage 1 JSON file
+        
+        The file is parsed as a stream and reading stops once every field is
+        found; Stage 1 writes raw_text ahead of the bulky line_level_data, so
+        the OCR polygons are never parsed.
+        """
+        stage1_data: Dict[str, Dict[str, Any]] = {'metadata': {}, 'ocr_results': {}}
+        remaining = set(STAGE1_FIELDS)
+        
+        with open(stage1_json_path, 'rb') as f:
+            for prefix, event, value in ijson.parse(f, use_float=True):
+                if prefix in remaining and event not in ('start_map', 'start_array'):
+                    section, field = prefix.split('.')
+                    stage1_data[section][field] = value
+                    remaining.discard(prefix)
+                    if not remaining:
+                        break
         
-        return results
+        return stage1_data
+    
+    def _load_cached(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Cached extraction for this content hash, if present and fresh"""
+        if self.cache_dir is None:
+            return None
+        
+        cache_path = self.cache_dir / f"{cache_key}.json"
+        try:
+            if (self.cache_ttl_seconds is not None 
+                    and time.time() - cache_path.stat().st_mtime > self.cache_ttl_seconds):
+                return None
+            with open(cache_path, 'rb') as f:
+                return orjson.loads(f.read())
+        except (OSError, orjson.JSONDecodeError):
+            return None
+    
+    def _store_cached(self, cache_key: str, extracted_data: Dict[str, Any]):
+        """Cache a successful extraction (failures are always retried)"""
+        if self.cache_dir is None or extracted_data.get('error'):
+            return
+        
+        with open(self.cache_dir / f"{cache_key}.json", 'wb') as f:
+            f.write(orjson.dumps(extracted_data))
+    
+    def _build_result(self, stage1_data: Dict[str, Any], 
+                      extracted_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Validate extracted data and wrap it with Stage 1 metadata"""
+        if validate_extracted_data(extracted_data):
+            logger.info(f"   ✅ Extraction successful!")
+        else:
+            logger.warning(f"   ⚠️  Extraction completed with warnings")
+        
+        return {
+            "metadata": {
+                "source_file": stage1_data['metadata']['filename'],
+                "stage1_confidence": stage1_data['ocr_results']['confidence'],
+                "processed_at": stage1_data['metadata']['processing_date']
+            },
+            "invoice_data": extracted_data
+        }
     
     def _save_result(self, result: Dict[str, Any], stage1_path: str) -> Path:
         """Save Stage 2 result to JSON file"""
@@ -128,7 +264,7 @@ class GroqStage2Pipeline:
         output_name = stage1_name.replace("_stage1", "_stage2") + ".json"
         output_path = self.output_dir / output_name
         
-        with open(output_path, 'w', encoding='utf-8') as f:
-            json.dump(result, f, indent=2, ensure_ascii=False)
+        with open(output_path, 'wb') as f:
+            f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
         
         return output_path
@@ -3,36 +3,280 @@ Stage 3: Export extracted invoice data to CSV files
 Creates normalized CSV files for invoices, line items, vendors, and customers
 """
 
-import json
-import pandas as pd
+import csv
+import hashlib
+import logging
+import orjson
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Deque, Iterator, NamedTuple, Optional, Tuple, Type, Union, get_args, get_type_hints
 from datetime import datetime
+from itertools import islice
+from tqdm import tqdm
+from tqdm.contrib.logging import logging_redirect_tqdm
+
+logger = logging.getLogger(__name__)
+
+# Output rows, one type per CSV (field order is column order). Tuples are
+# smaller than dicts and go to csv.writer as is.
+class VendorRow(NamedTuple):
+    vendor_id: int
+    name: Optional[str]
+    address: Optional[str]
+    phone: Optional[str]
+    email: Optional[str]
+
+
+class CustomerRow(NamedTuple):
+    customer_id: int
+    name: Optional[str]
+    address: Optional[str]
+    phone: Optional[str]
+    customer_code: Optional[str]
+
+
+class InvoiceRow(NamedTuple):
+    invoice_id: int
+    invoice_number: Optional[str]
+    order_number: Optional[str]
+    invoice_date: Optional[str]
+    order_date: Optional[str]
+    due_date: Optional[str]
+    vendor_id: int
+    customer_id: int
+    subtotal: Optional[float]
+    tax: Optional[float]
+    discount: Optional[float]
+    freight: Optional[float]
+    total: Optional[float]
+    payment_terms: Optional[str]
+    currency: Optional[str]
+    source_file: str
+
+
+class LineItemRow(NamedTuple):
+    line_item_id: int
+    invoice_id: int
+    product_id: Optional[str]
+    description: Optional[str]
+    quantity: Optional[float]
+    unit: Optional[str]
+    unit_price: Optional[float]
+    total_price: Optional[float]
+
+
+RowType = Union[Type[VendorRow], Type[CustomerRow], Type[InvoiceRow], Type[LineItemRow]]
+
+VENDOR_COLS = VendorRow._fields
+CUSTOMER_COLS = CustomerRow._fields
+INVOICE_COLS = InvoiceRow._fields
+LINE_ITEM_COLS = LineItemRow._fields
+
+# Write buffer for CSV files: rows reach the OS in 1 MiB blocks instead of 8 KiB
+CSV_WRITE_BUFFER = 1 << 20
+
+# Static parts of metadata.json
+CSV_FILE_DESCRIPTIONS = {
+    "vendors.csv": "Unique vendors with contact information",
+    "customers.csv": "Unique customers with contact information",
+    "invoices.csv": "Invoice headers with totals and references",
+    "line_items.csv": "Individual line items for each invoice"
+}
+CSV_RELATIONSHIPS = {
+    "invoices.vendor_id": "→ vendors.vendor_id",
+    "invoices.customer_id": "→ customers.customer_id",
+    "line_items.invoice_id": "→ invoices.invoice_id"
+}
+
+# metadata.json with the static sections pre-rendered; only the export
+# date and counts are filled in per export. Same bytes as
+# orjson.dumps(metadata, option=OPT_INDENT_2) of the full dict.
+_METADATA_TEMPLATE = (
+    b'{\n'
+    b'  "export_date": %b,\n'
+    b'  "total_vendors": %d,\n'
+    b'  "total_customers": %d,\n'
+    b'  "total_invoices": %d,\n'
+    b'  "total_line_items": %d,\n'
+    + orjson.dumps(
+        {"files": CSV_FILE_DESCRIPTIONS, "relationships": CSV_RELATIONSHIPS},
+        option=orjson.OPT_INDENT_2
+    )[2:].replace(b'%', b'%%')  # continue the object opened above
+)
+
+# Stage 2 invoice_data fields read by CSVExporter._add_invoice
+INVOICE_FIELDS = (
+    'invoice_number', 'order_number', 'invoice_date', 'order_date', 'due_date',
+    'amounts', 'payment_terms', 'currency'
+)
+
+# Below this many files, starting worker processes costs more than it saves
+PARALLEL_MIN_FILES = 64
+
+# Files read ahead of the parser on the single-process path (bounds memory)
+READ_AHEAD = 16
+
+
+def parse_invoice(json_file: Path, content: Optional[bytes] = None) -> Optional[Dict[str, Any]]:
+    """
+    Parse one Stage 2 JSON file into the parts CSVExporter normalizes
+    
+    Pure (no exporter state), so it can run in worker processes.
+    
+    Args:
+        json_file: Stage 2 JSON file
+        content: The file's bytes, if already read
+    
+    Returns:
+        Dict with 'vendor', 'customer', 'invoice', 'line_items',
+        'source_file' and 'content_hash', or None if the extraction had failed
+    """
+    if content is None:
+        content = Path(json_file).read_bytes()
+    data = orjson.loads(content)
+    
+    invoice_data = data['invoice_data']
+    if invoice_data.get('error'):
+        return None
+    
+    # Keep only what the tables use; the rest of the extraction (e.g. notes or
+    # raw fields the LLM adds) is dropped here instead of being sent back from
+    # worker processes and held until export
+    record = {
+        'vendor': invoice_data['vendor'],
+        'customer': invoice_data['customer'],
+        'invoice': {key: invoice_data[key] for key in INVOICE_FIELDS if key in invoice_data},
+        'line_items': invoice_data.get('line_items', [])
+    }
+    
+    return {
+        **record,
+        'source_file': data['metadata']['source_file'],
+        # Identifies the same extraction reached through another file (a
+        # copied PDF or a re-run saved under a new name)
+        'content_hash': hashlib.sha256(
+            orjson.dumps(record, option=orjson.OPT_SORT_KEYS)
+        ).digest()
+    }
+
+
+def _parse_in_worker(json_file: Path, content: Optional[bytes] = None) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """parse_invoice, with the error returned instead of raised so one bad file does not stop the batch"""
+    try:
+        return parse_invoice(json_file, content), None
+    except Exception as e:
+        return None, str(e)
+
+
+
+def _to_float(value: Any) -> Optional[float]:
+    """A numeric field as float: numbers given as text ("1,234.50") are parsed, anything unparseable is None"""
+    if value is None or isinstance(value, float):
+        return value
+    if isinstance(value, int):
+        return float(value)
+    try:
+        return float(str(value).strip().lstrip('$').replace(',', ''))
+    except ValueError:
+        return None
+
+
+def _to_text(value: Any) -> Optional[str]:
+    """A text field as str (e.g. an invoice number the LLM gave as a number)"""
+    return value if value is None or isinstance(value, str) else str(value)
+
+
+# Python annotation on the row NamedTuples -> Parquet column type
+_ARROW_TYPES = {int: pa.int64(), float: pa.float64(), str: pa.string()}
+_COERCE = {pa.float64(): _to_float, pa.string(): _to_text}
+
+
+def _arrow_schema(row_type: RowType) -> pa.Schema:
+    """Parquet schema for a row NamedTuple (Optional[X] columns are nullable X)"""
+    fields = []
+    for name, hint in get_type_hints(row_type).items():
+        base = next((arg for arg in get_args(hint) if arg is not type(None)), hint)
+        fields.append(pa.field(name, _ARROW_TYPES[base]))
+    return pa.schema(fields)
+
+
+_ARROW_SCHEMAS: Dict[RowType, pa.Schema] = {
+    row_type: _arrow_schema(row_type)
+    for row_type in (VendorRow, CustomerRow, InvoiceRow, LineItemRow)
+}
+
+
+def _to_table(rows: List[Any], row_type: RowType) -> pa.Table:
+    """
+    Arrow table from row tuples, typed by the row's schema
+    
+    LLM output can give a field in another type on some invoices (e.g. a
+    total as "576.63"); such values are coerced to the column's type, so one
+    extraction cannot turn a numeric column into text.
+    """
+    schema = _ARROW_SCHEMAS[row_type]
+    columns = zip(*rows) if rows else [()] * len(schema)
+    
+    arrays = []
+    for field, values in zip(schema, columns):
+        try:
+            arrays.append(pa.array(values, type=field.type))
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            convert = _COERCE[field.type]
+            arrays.append(pa.array([convert(v) for v in values], type=field.type))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _write_csv(filepath: Path, rows: List[Any], columns: Tuple[str, ...]) -> None:
+    """Write one table as CSV (header row, then one line per row tuple)"""
+    with open(filepath, 'w', newline='', encoding='utf-8', buffering=CSV_WRITE_BUFFER) as f:
+        writer = csv.writer(f, lineterminator='\n')
+        writer.writerow(columns)
+        writer.writerows(rows)
 
 
 class CSVExporter:
-    """Export Stage 2 JSON outputs to normalized CSV files"""
+    """Export Stage 2 JSON outputs to normalized Parquet (and CSV) files"""
     
-    def __init__(self, stage2_dir: str = "stage2_output", output_dir: str = "stage3_csv"):
+    def __init__(self, stage2_dir: str = "stage2_output", output_dir: str = "stage3_csv",
+                 max_workers: Optional[int] = None, export_csv: bool = True):
+        """
+        Args:
+            stage2_dir: Directory of Stage 2 JSON outputs
+            output_dir: Directory to write the tables to
+            max_workers: Processes used to parse large batches (default: CPU count;
+                1 parses in this process)
+            export_csv: Also write each table as CSV (Parquet is always written)
+        """
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.export_csv = export_csv
         self.stage2_dir = Path(stage2_dir)
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(exist_ok=True)
         
         # Data containers
-        self.vendors = []
-        self.customers = []
-        self.invoices = []
-        self.line_items = []
+        self.vendors: List[VendorRow] = []
+        self.customers: List[CustomerRow] = []
+        self.invoices: List[Optional[InvoiceRow]] = []  # None only in reserved slots
+        self.line_items: List[LineItemRow] = []
         
         # ID tracking for normalization
-        self.vendor_map = {}
-        self.customer_map = {}
+        self.vendor_map: Dict[Tuple[str, str], int] = {}
+        self.customer_map: Dict[Tuple[str, str], int] = {}
+        self.invoice_sources: Dict[bytes, str] = {}  # content hash -> first file with it
         self.invoice_counter = 1
+        self._invoices_filled = 0  # rows stored in self.invoices (the rest is reserved space)
         self.line_item_counter = 1
     
-    def process_all_invoices(self):
+    def process_all_invoices(self) -> Dict[str, int]:
         """Process all Stage 2 JSON files"""
-        json_files = list(self.stage2_dir.glob("*.json"))
+        with os.scandir(self.stage2_dir) as entries:
+            json_files = [Path(entry.path) for entry in entries
+                          if entry.name.endswith('.json') and entry.is_file()]
         
         print(f"\n🚀 Stage 3: CSV Export")
         print(f"   Found {len(json_files)} invoice files")
@@ -41,20 +285,37 @@ class CSVExporter:
         successful = 0
         failed = 0
         
-        for json_file in json_files:
-            try:
-                self._process_invoice_file(json_file)
-                successful += 1
-            except Exception as e:
-                print(f"   ❌ Error processing {json_file.name}: {e}")
-                failed += 1
+        # At most one invoice per file: reserve the slots instead of growing the list
+        self.invoices.extend([None] * len(json_files))
+        
+        errors = []  # (file name, message), reported after the progress bar
+        
+        with logging_redirect_tqdm():
+            parsed_files = zip(json_files, self._parse_all(json_files))
+            for json_file, (parsed, error) in tqdm(parsed_files, total=len(json_files),
+                                                    desc="Stage 3", unit="file"):
+                if error is not None:
+                    errors.append((json_file.name, error))
+                    failed += 1
+                    continue
+                
+                try:
+                    self._add_parsed(json_file, parsed)
+                    successful += 1
+                except Exception as e:
+                    errors.append((json_file.name, str(e)))
+                    failed += 1
+        
+        # Drop slots left by failed and skipped files
+        del self.invoices[self._invoices_filled:]
         
         print(f"\n📊 Processing complete:")
         print(f"   Successful: {successful}")
         print(f"   Failed: {failed}")
+        for name, error in errors:
+            logger.warning(f"   ❌ Error processing {name}: {error}")
         
-        # Export to CSV
-        self._export_to_csv()
+        self._export()
         
         return {
             "successful": successful,
@@ -65,74 +326,114 @@ class CSVExporter:
             "line_items": len(self.line_items)
         }
     
-    def _process_invoice_file(self, json_file: Path):
-        """Process a single invoice JSON file"""
-        with open(json_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
+    def _parse_all(self, json_files: List[Path]) -> Iterator[Tuple[Optional[Dict[str, Any]], Optional[str]]]:
+        """
+        Parse files in input order, across worker processes for large batches
+        
+        Only decoding runs in the workers; IDs are assigned afterwards in this
+        process, so they do not depend on the number of workers. Small batches
+        keep up to READ_AHEAD reads in flight on threads while parsing, so slow
+        storage overlaps with decoding without holding every file in memory.
+        """
+        if self.max_workers > 1 and len(json_files) >= PARALLEL_MIN_FILES:
+            workers = min(self.max_workers, len(json_files))
+            print(f"   Parsing with {workers} worker processes")
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                yield from executor.map(_parse_in_worker, json_files, chunksize=16)
+        else:
+            with ThreadPoolExecutor(max_workers=READ_AHEAD) as readers:
+                files = iter(json_files)
+                pending: Deque[Tuple[Path, Future]] = deque(
+                    (json_file, readers.submit(json_file.read_bytes))
+                    for json_file in islice(files, READ_AHEAD)
+                )
+                while pending:
+                    json_file, read = pending.popleft()
+                    next_file = next(files, None)
+                    if next_file is not None:
+                        pending.append((next_file, readers.submit(next_file.read_bytes)))
+                    try:
+                        content = read.result()
+                    except Exception as e:
+                        yield None, str(e)
+                        continue
+                    yield _parse_in_worker(json_file, content)
+    
+    def _add_parsed(self, json_file: Path, parsed: Optional[Dict[str, Any]]) -> None:
+        """Normalize one parsed invoice into the vendor/customer/invoice/line item tables"""
         # Skip if extraction failed
-        if data['invoice_data'].get('error'):
-            print(f"   ⏭️  Skipping failed: {json_file.name}")
+        if parsed is None:
+            logger.info(f"   ⏭️  Skipping failed: {json_file.name}")
             return
         
-        invoice_data = data['invoice_data']
-        metadata = data['metadata']
+        # Skip invoices already exported from another file (their line items
+        # would be counted twice)
+        first_file = self.invoice_sources.get(parsed['content_hash'])
+        if first_file is not None and first_file != json_file.name:
+            logger.info(f"   ⏭️  Skipping duplicate of {first_file}: {json_file.name}")
+            return
         
         # Process vendor
-        vendor_id = self._add_vendor(invoice_data['vendor'])
+        vendor_id = self._add_vendor(parsed['vendor'])
         
         # Process customer
-        customer_id = self._add_customer(invoice_data['customer'])
+        customer_id = self._add_customer(parsed['customer'])
         
         # Process invoice
         invoice_id = self._add_invoice(
-            invoice_data, 
-            metadata['source_file'],
+            parsed['invoice'], 
+            parsed['source_file'],
             vendor_id, 
             customer_id
         )
         
         # Process line items
-        for item in invoice_data.get('line_items', []):
-            self._add_line_item(invoice_id, item)
+        self._add_line_items(invoice_id, parsed['line_items'])
+        
+        # Only an invoice that made it into the tables counts as exported
+        self.invoice_sources[parsed['content_hash']] = json_file.name
     
     def _add_vendor(self, vendor: Dict[str, Any]) -> int:
         """Add vendor and return vendor_id"""
-        vendor_key = f"{vendor.get('name', '')}|{vendor.get('address', '')}"
+        get = vendor.get
+        vendor_key = (get('name') or '', get('address') or '')
         
-        if vendor_key in self.vendor_map:
-            return self.vendor_map[vendor_key]
+        vendor_id = self.vendor_map.get(vendor_key)
+        if vendor_id is not None:
+            return vendor_id
         
         vendor_id = len(self.vendors) + 1
         self.vendor_map[vendor_key] = vendor_id
         
-        self.vendors.append({
-            'vendor_id': vendor_id,
-            'name': vendor.get('name'),
-            'address': vendor.get('address'),
-            'phone': vendor.get('phone'),
-            'email': vendor.get('email')
-        })
+        self.vendors.append(VendorRow(
+            vendor_id=vendor_id,
+            name=get('name'),
+            address=get('address'),
+            phone=get('phone'),
+            email=get('email')
+        ))
         
         return vendor_id
     
     def _add_customer(self, customer: Dict[str, Any]) -> int:
         """Add customer and return customer_id"""
-        customer_key = f"{customer.get('name', '')}|{customer.get('address', '')}"
+        get = customer.get
+        customer_key = (get('name') or '', get('address') or '')
         
-        if customer_key in self.customer_map:
-            return self.customer_map[customer_key]
+        customer_id = self.customer_map.get(customer_key)
+        if customer_id is not None:
+            return customer_id
         
         customer_id = len(self.customers) + 1
         self.customer_map[customer_key] = customer_id
         
-        self.customers.append({
-            'customer_id': customer_id,
-            'name': customer.get('name'),
-            'address': customer.get('address'),
-            'phone': customer.get('phone'),
-            'customer_code': customer.get('customer_id')
-        })
+        self.customers.append(CustomerRow(
+            customer_id=customer_id,
+            name=get('name'),
+            address=get('address'),
+            phone=get('phone'),
+            customer_code=get('customer_id')
+        ))
         
         return customer_id
     
@@ -142,67 +443,72 @@ class CSVExporter:
         invoice_id = self.invoice_counter
         self.invoice_counter += 1
         
-        amounts = invoice_data.get('amounts', {})
-        
-        self.invoices.append({
-            'invoice_id': invoice_id,
-            'invoice_number': invoice_data.get('invoice_number'),
-            'order_number': invoice_data.get('order_number'),
-            'invoice_date': invoice_data.get('invoice_date'),
-            'order_date': invoice_data.get('order_date'),
-            'due_date': invoice_data.get('due_date'),
-            'vendor_id': vendor_id,
-            'customer_id': customer_id,
-            'subtotal': amounts.get('subtotal'),
-            'tax': amounts.get('tax'),
-            'discount': amounts.get('discount'),
-            'freight': amounts.get('freight'),
-            'total': amounts.get('total'),
-            'payment_terms': invoice_data.get('payment_terms'),
-            'currency': invoice_data.get('currency', 'USD'),
-            'source_file': source_file
-        })
+        get = invoice_data.get
+        amount = (get('amounts') or {}).get
+        
+        row = InvoiceRow(
+            invoice_id=invoice_id,
+            invoice_number=get('invoice_number'),
+            order_number=get('order_number'),
+            invoice_date=get('invoice_date'),
+            order_date=get('order_date'),
+            due_date=get('due_date'),
+            vendor_id=vendor_id,
+            customer_id=customer_id,
+            subtotal=amount('subtotal'),
+            tax=amount('tax'),
+            discount=amount('discount'),
+            freight=amount('freight'),
+            total=amount('total'),
+            payment_terms=get('payment_terms'),
+            currency=get('currency', 'USD'),
+            source_file=source_file
+        )
+        
+        if self._invoices_filled < len(self.invoices):
+            self.invoices[self._invoices_filled] = row
+        else:
+            self.invoices.append(row)
+        self._invoices_filled += 1
         
         return invoice_id
     
-    def _add_line_item(self, invoice_id: int, item: Dict[str, Any]):
-        """Add line item"""
+    def _add_line_items(self, invoice_id: int, items: List[Dict[str, Any]]) -> None:
+        """Add an invoice's line items (attribute lookups hoisted out of the per-item loop)"""
+        append = self.line_items.append
         line_item_id = self.line_item_counter
-        self.line_item_counter += 1
-        
-        self.line_items.append({
-            'line_item_id': line_item_id,
-            'invoice_id': invoice_id,
-            'product_id': item.get('product_id'),
-            'description': item.get('description'),
-            'quantity': item.get('quantity'),
-            'unit': item.get('unit'),
-            'unit_price': item.get('unit_price'),
-            'total_price': item.get('total_price')
-        })
-    
-    def _export_to_csv(self):
-        """Export all data to CSV files"""
-        print(f"\n💾 Exporting to CSV files...")
         
-        # Create DataFrames
-        df_vendors = pd.DataFrame(self.vendors)
-        df_customers = pd.DataFrame(self.customers)
-        df_invoices = pd.DataFrame(self.invoices)
-        df_line_items = pd.DataFrame(self.line_items)
-        
-        # Save to CSV
-        csv_files = {
-            'vendors.csv': df_vendors,
-            'customers.csv': df_customers,
-            'invoices.csv': df_invoices,
-            'line_items.csv': df_line_items
+        for item in items:
+            get = item.get
+            append(LineItemRow(
+                line_item_id=line_item_id,
+                invoice_id=invoice_id,
+                product_id=get('product_id'),
+                description=get('description'),
+                quantity=get('quantity'),
+                unit=get('unit'),
+                unit_price=get('unit_price'),
+                total_price=get('total_price')
+            ))
+            line_item_id += 1
+        
+        self.line_item_counter = line_item_id
+    
+    def _tables(self) -> Dict[str, Tuple[List[Any], RowType]]:
+        """Table name -> (rows, row type)"""
+        return {
+            'vendors': (self.vendors, VendorRow),
+            'customers': (self.customers, CustomerRow),
+            'invoices': (self.invoices, InvoiceRow),
+            'line_items': (self.line_items, LineItemRow)
         }
-        
-        for filename, df in csv_files.items():
-            filepath = self.output_dir / filename
-            df.to_csv(filepath, index=False, encoding='utf-8')
-            print(f"   ✅ {filename}: {len(df)} rows")
+    
+    def _export(self) -> None:
+        """Write every table, then the summary and metadata"""
+        # CSV first, so the Parquet files are the newer copies the analyzer loads
+        if self.export_csv:
+            self._export_to_csv()
+        self._export_to_parquet()
         
         # Print summary
         print(f"\n📊 Export Summary:")
@@ -214,36 +520,51 @@ class CSVExporter:
         # Create metadata file
         self._create_metadata()
     
-    def _create_metadata(self):
-        """Create metadata file describing the CSVs"""
-        metadata = {
-            "export_date": datetime.now().isoformat(),
-            "total_vendors": len(self.vendors),
-            "total_customers": len(self.customers),
-            "total_invoices": len(self.invoices),
-            "total_line_items": len(self.line_items),
-            "files": {
-                "vendors.csv": "Unique vendors with contact information",
-                "customers.csv": "Unique customers with contact information",
-                "invoices.csv": "Invoice headers with totals and references",
-                "line_items.csv": "Individual line items for each invoice"
-            },
-            "relationships": {
-                "invoices.vendor_id": "→ vendors.vendor_id",
-                "invoices.customer_id": "→ customers.customer_id",
-                "line_items.invoice_id": "→ invoices.invoice_id"
+    def _export_to_csv(self) -> None:
+        """Export all data to CSV files"""
+        print(f"\n💾 Exporting to CSV files...")
+        
+        # The files are independent: overlap their writes (file I/O releases the GIL)
+        tables = self._tables()
+        with ThreadPoolExecutor(max_workers=len(tables)) as executor:
+            writes = {
+                name: executor.submit(_write_csv, self.output_dir / f"{name}.csv", rows, row_type._fields)
+                for name, (rows, row_type) in tables.items()
             }
-        }
+            for name, write in writes.items():
+                write.result()
+                print(f"   ✅ {name}.csv: {len(tables[name][0])} rows")
+    
+    def _export_to_parquet(self) -> None:
+        """Export all data to zstd-compressed Parquet files (typed, columnar)"""
+        print(f"\n💾 Exporting to Parquet files...")
+        
+        for name, (rows, row_type) in self._tables().items():
+            filename = f"{name}.parquet"
+            pq.write_table(_to_table(rows, row_type), self.output_dir / filename, compression='zstd')
+            print(f"   ✅ {filename}: {len(rows)} rows")
+    
+    def _create_metadata(self) -> None:
+        """Create metadata file describing the tables"""
+        metadata = _METADATA_TEMPLATE % (
+            orjson.dumps(datetime.now().isoformat()),
+            len(self.vendors),
+            len(self.customers),
+            len(self.invoices),
+            len(self.line_items)
+        )
         
         metadata_file = self.output_dir / "metadata.json"
-        with open(metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, indent=2)
+        with open(metadata_file, 'wb') as f:
+            f.write(metadata)
         
         print(f"   ✅ metadata.json")
 
 
-def main():
+def main() -> None:
     """Main execution"""
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"), format="%(message)s")
+    
     print("=" * 60)
     print("STAGE 3: CSV EXPORT")
     print("=" * 60)
@@ -255,10 +576,10 @@ def main():
     print("CSV EXPORT COMPLETE!")
     print("=" * 60)
     print(f"\n📁 Output location: stage3_csv/")
-    print(f"   ✅ vendors.csv")
-    print(f"   ✅ customers.csv")
-    print(f"   ✅ invoices.csv")
-    print(f"   ✅ line_items.csv")
+    print(f"   ✅ vendors.parquet / vendors.csv")
+    print(f"   ✅ customers.parquet / customers.csv")
+    print(f"   ✅ invoices.parquet / invoices.csv")
+    print(f"   ✅ line_items.parquet / line_items.csv")
     print(f"   ✅ metadata.json")
 
 
@@ -2,14 +2,20 @@
 Retry failed Stage 2 extractions
 """
 
+import logging
 import os
 from dotenv import load_dotenv
 from preprocessing.stage2_groq_pipeline import GroqStage2Pipeline
 
 def main():
     load_dotenv()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(message)s")
     api_key = os.getenv('GROQ_API_KEY')
     
+    if not api_key:
+        print("❌ Error: GROQ_API_KEY not found in .env file")
+        return
+    
     print("🔄 Retrying failed extractions with increased max_tokens...")
     
     pipeline = GroqStage2Pipeline(
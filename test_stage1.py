@@ -4,9 +4,13 @@ Processes ALL invoices in data/ folder
 """
 
 from preprocessing.stage1_pipeline import Stage1Pipeline
+import logging
 import os
 
 def main():
+    # Per-invoice details are logged at INFO (LOG_LEVEL=INFO to show them)
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"), format="%(message)s")
+    
     print("\n" + "="*70)
     print("STAGE 1: INVOICE OCR PROCESSING")
     print("="*70 + "\n")
@@ -2,6 +2,7 @@
 Test Stage 2 using Groq API (Fast and Accurate!)
 """
 
+import logging
 import os
 from dotenv import load_dotenv
 from preprocessing.stage2_groq_pipeline import GroqStage2Pipeline
@@ -9,6 +10,8 @@ from preprocessing.stage2_groq_pipeline import GroqStage2Pipeline
 
 def main():
     load_dotenv()
+    # Per-invoice details are logged at INFO (LOG_LEVEL=INFO to show them)
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING"), format="%(message)s")
     api_key = os.getenv('GROQ_API_KEY')
     
     if not api_key: